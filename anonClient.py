@@ -0,0 +1,124 @@
+import re
+import time
+import threading
+from collections import deque
+import requests
+import tracer
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+defaultMaxInFlight = 8       # maximum number of queries outstanding at the anonymizer
+defaultRetries = 3           # number of times a failed request is retried
+defaultTimeout = 60          # seconds before a single request is abandoned
+defaultBackoff = 0.5         # seconds before the first retry, doubled on each retry
+latencyWindow = 10000        # most recent request latencies kept for reporting
+
+# Answers meaning that the endpoint doesn't hold the database that was asked for
+missingDbPattern = re.compile(r'unknown database|no such database|database .*not found',re.I)
+
+def _missingDb(ans):
+    return (isinstance(ans,dict) and ans.get('success') is False and
+            missingDbPattern.search(str(ans.get('error',''))) is not None)
+
+def _numRows(ans):
+    try:
+        return len(ans['result']['rows'])
+    except (KeyError,TypeError):
+        return None
+
+class anonClient:
+    ''' Sends query requests to the anonymizing endpoint over a pool of persistent
+        connections. At most maxInFlight requests are outstanding at any time, and
+        batch submission blocks until a slot is free. With an endpointPool, each
+        request goes to an endpoint holding its database and queryUrl is unused.
+    '''
+    def __init__(self,queryUrl,maxInFlight=defaultMaxInFlight,retries=defaultRetries,
+                 timeout=defaultTimeout,backoff=defaultBackoff,pool=None):
+        self.queryUrl = queryUrl
+        self.pool = pool
+        self.maxInFlight = maxInFlight
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.session = requests.Session()
+        numHosts = len(pool.endpoints) if pool is not None else 1
+        adapter = HTTPAdapter(pool_connections=numHosts,pool_maxsize=maxInFlight)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+        self.slots = threading.BoundedSemaphore(maxInFlight)
+        self.executor = None
+        self.answered = 0       # requests answered so far
+        self.latencies = deque(maxlen=latencyWindow)    # seconds per answered request, including retries
+        self.lock = threading.Lock()
+        self.trace = tracer.getTracer()
+
+    def query(self,req):
+        ''' Sends one request and returns the decoded json answer, or None if the
+            request still failed after all retries
+        '''
+        with self.trace.span('anonQuery',sql=req.get('query')) as span:
+            delay = self.backoff
+            start = time.perf_counter()
+            attempt = 0
+            while attempt <= self.retries:
+                ep = None
+                if self.pool is not None:
+                    ep = self.pool.choose(req['database'])
+                    if ep is None:
+                        span.set(error='no endpoint holds the database')
+                        return None
+                url = ep.queryUrl if ep is not None else self.queryUrl
+                sent = time.perf_counter()
+                ok = False
+                try:
+                    response = self.session.post(url,json=req,timeout=self.timeout)
+                    ok = response.status_code < 500
+                    if ok:
+                        ans = response.json()
+                        if ep is not None and _missingDb(ans):
+                            # Not a failure of the endpoint, so try another holder straight away
+                            self.pool.done(ep,time.perf_counter() - sent)
+                            self.pool.missing(req['database'],ep)
+                            attempt += 1
+                            continue
+                        with self.lock:
+                            self.answered += 1
+                            self.latencies.append(time.perf_counter() - start)
+                        if ep is not None:
+                            self.pool.done(ep,time.perf_counter() - sent)
+                            span.set(endpoint=url)
+                        if self.trace.enabled:
+                            span.set(status=response.status_code,bytes=len(response.content),
+                                     rows=_numRows(ans),attempts=attempt + 1)
+                        return ans
+                    span.set(status=response.status_code)
+                except (requests.RequestException,ValueError):
+                    # Includes broken or badly encoded response bodies, not just lost connections
+                    ok = False
+                if ep is not None:
+                    self.pool.done(ep,ok=False)
+                if attempt < self.retries:
+                    time.sleep(delay)
+                    delay *= 2
+                attempt += 1
+            span.set(attempts=self.retries + 1)
+            return None
+
+    def queryBatch(self,reqs):
+        ''' Sends all of the requests and returns the answers in the same order '''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.maxInFlight)
+        futures = []
+        for req in reqs:
+            # Backpressure: don't queue more than maxInFlight requests
+            self.slots.acquire()
+            future = self.executor.submit(self.query,req)
+            future.add_done_callback(lambda _: self.slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.session.close()
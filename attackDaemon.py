@@ -0,0 +1,180 @@
+import sys
+import json
+import time
+import socket
+import argparse
+import traceback
+import socketserver
+import contextlib
+import attacks
+from anonClient import anonClient
+
+''' A long-running worker that keeps the harness modules imported, the HTTP
+    connections to the query server open and recently built attack databases in
+    memory (see dbCache), so that re-running an attack only costs the work that
+    changed.
+
+    Clients connect to a local TCP port and send one json object per line:
+
+        {"spec": {...attack...}}     run the given attack spec
+        {"name": "..."}              run the spec of that name from the spec directory
+        {"index": 3}                 run the fourth spec in the spec directory
+        {"describe": "..."}          run the spec with that description
+
+    Specs are read from their files for every request, so edits to them are
+    picked up without restarting.
+
+    Optional keys are "check" and "doAttack" (both default true). For each request
+    the daemon streams back json lines: {"event": "log", "text": ...} for every
+    line the attack prints, then {"event": "result", ...}.
+'''
+
+defaultPort = 8765
+
+class _lineWriter:
+    ''' File-like object that sends each printed line to the client as a log event '''
+    def __init__(self,send):
+        self.send = send
+        self.buf = ''
+
+    def write(self,text):
+        self.buf += text
+        while '\n' in self.buf:
+            line,self.buf = self.buf.split('\n',1)
+            self.send({'event':'log','text':line})
+        return len(text)
+
+    def flush(self):
+        if self.buf:
+            self.send({'event':'log','text':self.buf})
+            self.buf = ''
+
+class attackDaemon(socketserver.TCPServer):
+    ''' Handles one request at a time, so printed output can be redirected safely '''
+    allow_reuse_address = True
+
+    def __init__(self,port=defaultPort,queryUrl='https://db-proto.probsteide.com/api',
+                 fileUrl='https://db-proto.probsteide.com/api/upload-db',
+                 specDir=attacks.defaultSpecDir):
+        super().__init__(('127.0.0.1',port),_daemonHandler)
+        self.queryUrl = queryUrl
+        self.fileUrl = fileUrl
+        self.specDir = specDir
+        self.clients = {}
+
+    def getClient(self,attack):
+        ''' One anonClient, with its connection pool, per query url and settings '''
+        key = json.dumps([self.queryUrl,attack.get('clientParams',{})],sort_keys=True)
+        if key not in self.clients:
+            self.clients[key] = anonClient(self.queryUrl,**attack.get('clientParams',{}))
+        return self.clients[key]
+
+    def selectAttack(self,req):
+        if 'spec' in req:
+            return req['spec']
+        if 'name' in req:
+            specs = attacks.loadSpecs(self.specDir,names=[req['name']])
+            if len(specs) == 0:
+                raise KeyError(f"no attack spec named {req['name']}")
+            return specs[0]
+        specs = attacks.loadSpecs(self.specDir)
+        if 'index' in req:
+            return specs[req['index']]
+        for attack in specs:
+            if attack['describe'] == req['describe']:
+                return attack
+        raise KeyError(f"no attack described as {req['describe']}")
+
+    def runRequest(self,req):
+        result = {'event':'result','passed':False,'error':None}
+        start = time.perf_counter()
+        ra = None
+        try:
+            attack = self.selectAttack(req)
+            result['describe'] = attack['describe']
+            ra = attacks.runAttack(attack,queryUrl=self.queryUrl,fileUrl=self.fileUrl,
+                                   client=self.getClient(attack))
+            result['dbName'] = ra.dbName
+            result['timings'] = dict(ra.timings)
+            passed = True
+            if req.get('check',True):
+                passed = ra.runCheck() and passed
+            if req.get('doAttack',True):
+                passed = ra.runAttack() and passed
+            result['passed'] = passed
+        except attacks.attackFailed as e:
+            result['error'] = str(e)
+        except Exception:
+            result['error'] = traceback.format_exc()
+        finally:
+            if ra is not None:
+                ra.close()
+        result['elapsed'] = time.perf_counter() - start
+        return result
+
+class _daemonHandler(socketserver.StreamRequestHandler):
+    def send(self,obj):
+        self.wfile.write((json.dumps(obj,default=str) + '\n').encode())
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line)
+            except ValueError as e:
+                self.send({'event':'result','passed':False,'error':f"bad request: {e}"})
+                continue
+            writer = _lineWriter(self.send)
+            with contextlib.redirect_stdout(writer):
+                result = self.server.runRequest(req)
+                writer.flush()
+            self.send(result)
+
+def submit(req,port=defaultPort):
+    ''' Sends one request to a running daemon, yielding the events it streams back '''
+    with socket.create_connection(('127.0.0.1',port)) as sock:
+        sock.sendall((json.dumps(req) + '\n').encode())
+        with sock.makefile('r') as f:
+            for line in f:
+                event = json.loads(line)
+                yield event
+                if event['event'] == 'result':
+                    return
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm attack worker. Without --name, --index, '
+                                     '--describe or --spec it runs as the daemon.')
+    parser.add_argument('--port',type=int,default=defaultPort)
+    parser.add_argument('--queryUrl',default='https://db-proto.probsteide.com/api')
+    parser.add_argument('--fileUrl',default='https://db-proto.probsteide.com/api/upload-db')
+    parser.add_argument('--specDir',default=attacks.defaultSpecDir)
+    parser.add_argument('--name',default=None,help='run the attack spec of this name')
+    parser.add_argument('--index',type=int,default=None,help='run the spec at this position in the spec directory')
+    parser.add_argument('--describe',default=None,help='run the attack with this description')
+    parser.add_argument('--spec',default=None,help='run the attack spec in this json file')
+    parser.add_argument('--noCheck',action='store_true')
+    parser.add_argument('--noAttack',action='store_true')
+    args = parser.parse_args()
+    if args.name is None and args.index is None and args.describe is None and args.spec is None:
+        daemon = attackDaemon(port=args.port,queryUrl=args.queryUrl,fileUrl=args.fileUrl,
+                              specDir=args.specDir)
+        print(f"attack daemon listening on port {args.port}")
+        daemon.serve_forever()
+    req = {'check':not args.noCheck,'doAttack':not args.noAttack}
+    if args.spec is not None:
+        with open(args.spec) as f:
+            req['spec'] = json.load(f)
+    elif args.name is not None:
+        req['name'] = args.name
+    elif args.index is not None:
+        req['index'] = args.index
+    else:
+        req['describe'] = args.describe
+    for event in submit(req,port=args.port):
+        if event['event'] == 'log':
+            print(event['text'])
+        else:
+            print(json.dumps(event,indent=4))
+            sys.exit(0 if event['passed'] else 1)
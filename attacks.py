@@ -1,92 +1,536 @@
-import whereParser
-import rowFiller
 import pprint
 import re
+import os
+import time
+import json
+import shutil
+import random
+import math
+import statistics
+import tempfile
+import argparse
+import weakref
+import functools
+import traceback
+import multiprocessing.util
 import requests
-import pandas as pd
-import numpy as np
+from anonClient import anonClient
+import queryPlanner
+import queryCache
+import tracer
+import dbCache
+from dbUploader import dbUploader
+import dbDelta
+import rawBackend
+import columnStats
+import endpointPool
+from concurrent.futures import ProcessPoolExecutor
 
 defaultNumSamples = 100               # number of times each test should repeat (for average)
+defaultNumWorkers = os.cpu_count()    # size of the process pool used by runSuite()
+
+class attackFailed(Exception):
+    ''' Raised when an attack does not behave as expected '''
+    pass
 
 class runAttack:
     ''' Contains various support routines for running attacks '''
     def __init__(self,attack,queryUrl='https://db-proto.probsteide.com/api',
-                 fileUrl='https://db-proto.probsteide.com/api/upload-db'):
+                 fileUrl='https://db-proto.probsteide.com/api/upload-db',dbName=None,client=None,
+                 pool=None,upload=True):
+        ''' dbName is the name the database is stored and queried under on the
+            server. By default it is derived from the hash of the attack spec, so
+            runs with different specs never share a database. client is an
+            anonClient to reuse, so that its connections stay open across attacks.
+            pool is an endpointPool to use instead of the single queryUrl/fileUrl.
+            With upload False the database is only built locally, which is enough
+            for runCheck(); call uploadDb() before running the attack.
+        '''
         self.pp = pprint.PrettyPrinter(indent=4)
         self.attack = attack
         self.queryUrl = queryUrl
         self.fileUrl = fileUrl
+        self.pool = pool
+        self.trace = tracer.getTracer().forAttack(attack['describe'])
+        self.ownsClient = client is None
+        if client is None:
+            client = anonClient(queryUrl,pool=pool,**attack.get('clientParams',{}))
+        self.client = client
+        self.client.trace = self.trace
+        # A seed of None asks the anonymizer for fresh noise, so those answers aren't cached
+        self.anonSeed = attack.get('anonSeed',1)
+        self.answerCache = None
+        if attack.get('useQueryCache',True):
+            self.answerCache = queryCache.getCache(attack.get('queryCacheDir'))
         dop = False
         if 'doprint' in self.attack:
             dop = self.attack['doprint']
-        # build attack database
-        self.sw = whereParser.simpleWhere(attack['conditionsSql'])
-        self.rf = rowFiller.rowFiller(self.sw,printIntermediateTables=False,dop=dop)
-        self.rf.makeBaseTables()
-        if len(self.rf.failedCombinations) > 0:
+        self.seed = attack.get('seed',dbCache.defaultSeed)
+        # With a scaleFactor above 1 the database is scaled up after it is built
+        self.scaleFactor = attack.get('scaleFactor',1)
+        if (isinstance(self.scaleFactor,bool) or not isinstance(self.scaleFactor,int)
+                or self.scaleFactor < 1):
+            self._error(f"ERROR: scaleFactor must be a whole number of at least 1, "
+                        f"not {self.scaleFactor!r}")
+        self.basePath = None
+        self.tmpDir = None      # holds scaled databases that aren't cached, see close()
+        self.dbHash = dbCache.specHash(attack,self.seed)
+        self.cache = dbCache.dbCache() if attack.get('useDbCache',True) else None
+        self.baseHash = dbCache.baseHash(attack,self.seed)
+        self.sw = None
+        self.raw = None         # rawBackend, opened on the first raw query
+        self.compiled = {}      # attack query templates compiled for rawBackend
+        self.replaced = {}      # attack queries with their -xx- placeholders filled in
+        self.timings = {}       # seconds spent building and uploading the database
+        self.outcome = None     # what the last anonymized attack saw, set by the attack
+        start = time.perf_counter()
+        with self.trace.span('cacheLoad') as span:
+            self.rf = self.cache.get(self.dbHash) if self.cache is not None else None
+            span.set(hit=self.rf is not None)
+        if self.rf is None:
+            self._buildDb(dop)
+            if self.cache is not None:
+                with self.trace.span('cacheStore'):
+                    self.cache.put(self.dbHash,self.rf)
+        self.dbPath = self.rf.getDbPath()
+        if self.scaleFactor > 1:
+            self.dbPath = self._scaleDb()
+        with self.trace.span('hashDb'):
+            self.dbContentHash = dbCache.fileHash(self.dbPath)
+        with self.trace.span('columnStats'):
+            self.stats = self._loadStats()
+        self._checkIsolation()
+        self.timings['build'] = time.perf_counter() - start
+        self.dbName = dbName if dbName is not None else f"attack_{self.dbHash[:16]}.db"
+        if upload:
+            self.uploadDb()
+
+    def uploadDb(self):
+        ''' Puts the database on the server, or on each endpoint it is placed on '''
+        start = time.perf_counter()
+        if self.pool is None:
+            self._uploadTo(self.fileUrl)
+        else:
+            for ep in self.pool.place(self.dbName):
+                self._uploadTo(ep.fileUrl)
+                # Queries only go to endpoints recorded here. The fail-over uploader
+                # holds the file and name, not this runAttack and its tables.
+                self.pool.uploaded(self.dbName,ep,
+                                   functools.partial(_uploadFile,self.dbPath,self.dbName,self.dbHash,
+                                                     self.attack.get('uploadParams',{})))
+        self.timings['upload'] = time.perf_counter() - start
+
+    def _uploadTo(self,fileUrl,force=False):
+        ''' Makes sure that the server at fileUrl holds this attack's database. With
+            force it is uploaded even if the server says it has it.
+        '''
+        with self.trace.span('serverCheck',fileUrl=fileUrl) as span:
+            onServer = self._serverHasDb(fileUrl=fileUrl)
+            span.set(onServer=onServer)
+        if onServer and not force:
+            print(f"{self.dbName} already on server")
+            return
+        with self.trace.span('upload',fileUrl=fileUrl) as span:
+            stats = None
+            if self.serverAcceptsDelta and self.attack['changes'] and self.cache is not None:
+                stats = self.postDelta(fileUrl)
+            if stats is None:
+                stats = self.postDb(fileUrl)
+            span.set(bytes=stats['fileBytes'],sentBytes=stats['sentBytes'])
+
+    def _makeBaseTables(self,dop):
+        ''' Returns a rowFiller holding the base tables for conditionsSql. Attacks
+            that share conditionsSql (and seed) share one build of the base tables,
+            and each gets its own copy to apply its changes to.
+        '''
+        if self.cache is not None:
+            with self.trace.span('baseCacheLoad') as span:
+                rf = self.cache.getBase(self.baseHash)
+                span.set(hit=rf is not None)
+            if rf is not None:
+                return rf
+        # Building tables needs rowFiller and numpy, so they are only imported when
+        # there is no cached build to use
+        import numpy as np
+        import whereParser
+        import rowFiller
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        with self.trace.span('parse'):
+            self.sw = whereParser.simpleWhere(self.attack['conditionsSql'])
+        rf = rowFiller.rowFiller(self.sw,printIntermediateTables=False,dop=dop)
+        with self.trace.span('makeBaseTables'):
+            rf.makeBaseTables()
+        if len(rf.failedCombinations) > 0:
             print("Failed Combinations:")
-            print(self.rf.failedCombinations)
-        for change in attack['changes']:
-            if change['change'] == 'append':
-                self.rf.appendDf(change['table'],change['spec'])
-            elif change['change'] == 'strip':
-                self.rf.stripDf(change['table'],change['query'])
-        self.rf.baseTablesToDb()
-        self.postDb()
+            print(rf.failedCombinations)
+        if self.cache is not None:
+            with self.trace.span('baseCacheStore'):
+                self.cache.putBase(self.baseHash,rf)
+        elif self.scaleFactor > 1:
+            # Scaling needs the base tables as they were before the changes
+            rf.baseTablesToDb()
+            self.basePath = os.path.join(self._tempDir(),'base.db')
+            shutil.copyfile(rf.getDbPath(),self.basePath)
+        return rf
+
+    def _buildDb(self,dop):
+        ''' Builds the attack database from the (possibly shared) base tables '''
+        self.rf = self._makeBaseTables(dop)
+        import numpy as np
+        # Seed again so that the changes don't depend on whether the base was cached
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        for change in self.attack['changes']:
+            with self.trace.span(change['change'],table=change['table']):
+                if change['change'] == 'append':
+                    self.rf.appendDf(change['table'],change['spec'])
+                elif change['change'] == 'strip':
+                    self.rf.stripDf(change['table'],change['query'])
+        with self.trace.span('baseTablesToDb') as span:
+            self.rf.baseTablesToDb()
+            if self.trace.enabled:
+                span.set(bytes=os.path.getsize(self.rf.getDbPath()))
+
+    def _scaleDb(self):
+        ''' Returns the path of the database scaled up by scaleFactor, building it
+            if it isn't cached
+        '''
+        import scaleBuilder
+        if self.cache is not None:
+            outPath = self.cache.scaledDbPath(self.dbHash)
+            if os.path.exists(outPath):
+                # Marks it as recently used, see dbCache.pruneScaled()
+                os.utime(outPath)
+                return outPath
+            basePath = self.cache.baseDbPath(self.baseHash)
+        else:
+            outPath = os.path.join(self._tempDir(),'scaled.db')
+            basePath = self.basePath
+        if basePath is None or not os.path.exists(basePath):
+            self._error(f"ERROR: base tables needed to scale {self.dbHash[:16]} are missing")
+        stripQueries = {}
+        for change in self.attack['changes']:
+            if change['change'] == 'strip':
+                stripQueries.setdefault(change['table'],[]).append(change['query'])
+        with self.trace.span('scaleDb',scaleFactor=self.scaleFactor) as span:
+            scaleBuilder.scaleDb(basePath,self.rf.getDbPath(),outPath,self.scaleFactor,
+                                 self.rf.getAidColumns(),stripQueries,
+                                 **self.attack.get('scaleParams',{}))
+            span.set(bytes=os.path.getsize(outPath))
+        if self.cache is None:
+            os.remove(basePath)
+            self.basePath = None
+        else:
+            self.cache.pruneScaled(keep=outPath)
+        return outPath
+
+    def _tempDir(self):
+        if self.tmpDir is None:
+            self.tmpDir = tempfile.mkdtemp(prefix='attackScaled_')
+            # In case close() is never called
+            weakref.finalize(self,shutil.rmtree,self.tmpDir,ignore_errors=True)
+        return self.tmpDir
+
+    def close(self):
+        ''' Closes the raw backend and the client (unless it was passed in), tells
+            the endpoint pool the database is done with, and removes the scaled
+            database if it wasn't cached
+        '''
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+        if self.ownsClient:
+            self.client.close()
+        if self.pool is not None:
+            self.pool.forget(self.dbName)
+        if self.tmpDir is not None:
+            shutil.rmtree(self.tmpDir,ignore_errors=True)
+            self.tmpDir = None
+
+    def _loadStats(self):
+        ''' Column statistics of the database, built the first time it is seen '''
+        if not self.attack.get('useColumnStats',True):
+            return None
+        if self.cache is not None:
+            path = self.cache.statsPath(self.dbContentHash)
+        else:
+            path = self.dbPath + '.stats.json'
+        stats = columnStats.columnStats.load(path,self.dbContentHash)
+        if stats is None:
+            stats = columnStats.buildStats(self.dbPath,self.attack['conditionsSql'],
+                                           self.rf.getAidColumns(),self.dbContentHash)
+            stats.save(path)
+        return stats
+
+    def _checkIsolation(self):
+        ''' Warns if a value the last appended row asked to be 'unique' isn't '''
+        appends = [change for change in self.attack['changes'] if change['change'] == 'append']
+        if len(appends) == 0:
+            return
+        change = appends[-1]
+        for col,vals in change['spec'].items():
+            if vals != ['unique']:
+                continue
+            val = rawBackend._plain(self.rf.getNewRowColumn(col))
+            count = None
+            if self.stats is not None:
+                count = self.stats.valueCount(change['table'],col,val)
+            if count is None:
+                count = self._queryRaw(f"select count(*) from {change['table']} where {col} = ?",
+                                       (val,))[0][0]
+            if count != 1:
+                print(f"WARNING: {col} = {val} of the appended row is in {count} rows, not 1")
+
+    def _statsAnswer(self,sql):
+        if self.stats is None:
+            return None
+        with self.trace.span('statsQuery',sql=sql) as span:
+            ans = self.stats.answer(sql)
+            span.set(answered=ans is not None)
+        return ans
+
+    def _serverHasDb(self,dbName=None,dbHash=None,fileUrl=None):
+        ''' Asks the upload endpoint whether it already holds this database. The
+            server answers a HEAD request with status 200 and the stored hash as
+            ETag, or 404. Anything else is treated as not present. A server that
+            can build a database from a base plus a delta says so with an
+            accepts-delta header.
+        '''
+        dbName = self.dbName if dbName is None else dbName
+        dbHash = self.dbHash if dbHash is None else dbHash
+        fileUrl = self.fileUrl if fileUrl is None else fileUrl
+        headers = {'db-name':dbName,
+                   'password':'great success',
+                   }
+        self.serverAcceptsDelta = False
+        try:
+            r = self.client.session.head(url=fileUrl,headers=headers,timeout=10)
+        except requests.RequestException:
+            return False
+        self.serverAcceptsDelta = r.headers.get('accepts-delta') == '1'
+        return r.status_code == 200 and r.headers.get('ETag','').strip('"') == dbHash
 
     def runCheck(self):
-        self.runAttack(check=True)
+        return self.runAttack(check=True)
 
     def runAttack(self,check=False):
         ''' This just checks to make sure that an attack on the raw data works as expected '''
         attackFunc = self.attackMap[self.attack['attackType']]
-        if attackFunc(self,check=check):
+        with self.trace.span('check' if check else 'attack'):
+            passed = attackFunc(self,check=check)
+        if passed:
             print(f"PASSED: {self.attack['describe']}")
+            return True
+        return False
 
-    def queryAnon(self,sql,anon=True,db='testAttack.db'):
-        aidCols = self.rf.getAidColumns()
-        req = {'Anonymize':anon,
-               'database':db,
-               'query':sql,
-               'seed':1,
-               'aid_columns':aidCols,
-               }
-        response = requests.post(self.queryUrl, json=req)
-        ans = response.json()
-        if ans['success'] == False:
+    def _makeAnonRequest(self,sql,anon,db,seed):
+        if db is None:
+            db = self.dbName
+        return {'Anonymize':anon,
+                'database':db,
+                'query':sql,
+                'seed':seed,
+                'aid_columns':self.rf.getAidColumns(),
+                }
+
+    def _checkAnonAnswer(self,ans):
+        if ans is None or ans['success'] == False:
             print("Query Error")
             self.pp.pprint(ans)
             return None
         return ans
 
-    def postDb(self):
-        fin = open(self.rf.getDbPath(), 'rb')
-        data = fin.read()
-        files = {'file': fin}
-        headers = {
-            'db-name':self.rf.getDbName(),
-            'password':'great success',
-            'Content-Type': 'application/octet-stream',
-        }
-        r = requests.post(url=self.fileUrl, data=data, headers=headers)
-        print(r.text)
-        fin.close()
+    def _anonRows(self,ans):
+        return ans['result']['rows']
+
+    def _answerKey(self,sql,anon,db=None,seed=None):
+        ''' Returns the answer cache key, or None if the answer must not be cached.
+            anon is 'raw' for queries on the local database.
+        '''
+        if self.answerCache is None or (anon != 'raw' and seed is None):
+            return None
+        dbKey = self.dbContentHash if db is None else db
+        return queryCache.makeKey(dbKey,sql,anon,seed,self.rf.getAidColumns())
+
+    def queryAnon(self,sql,anon=True,db=None,useCache=True):
+        key = self._answerKey(sql,anon,db,self.anonSeed) if useCache else None
+        if key is not None:
+            ans = self.answerCache.get(key)
+            if ans is not None:
+                return ans
+        req = self._makeAnonRequest(sql,anon,db,self.anonSeed)
+        ans = self._checkAnonAnswer(self.client.query(req))
+        if key is not None and ans is not None:
+            self.answerCache.put(key,ans)
+        return ans
+
+    def queryAnonBatch(self,sqls,anon=True,db=None,useCache=True,seeds=None):
+        ''' Runs the queries concurrently. Answers are returned in the order of sqls.
+            Only queries without a cached answer are sent. seeds optionally gives
+            the anonymizer seed for each query.
+        '''
+        if seeds is None:
+            seeds = [self.anonSeed] * len(sqls)
+        keys = [self._answerKey(sql,anon,db,seed) if useCache else None
+                for sql,seed in zip(sqls,seeds)]
+        answers = [self.answerCache.get(key) if key is not None else None for key in keys]
+        # Identical requests with a seed get identical answers, so each is sent once.
+        # Requests without a seed get fresh noise, so all of those are sent.
+        sendFor = {}
+        for i,ans in enumerate(answers):
+            if ans is None:
+                sendFor.setdefault(i if keys[i] is None else keys[i],[]).append(i)
+        groups = list(sendFor.values())
+        reqs = [self._makeAnonRequest(sqls[group[0]],anon,db,seeds[group[0]]) for group in groups]
+        for group,ans in zip(groups,self.client.queryBatch(reqs)):
+            ans = self._checkAnonAnswer(ans)
+            for i in group:
+                answers[i] = ans
+            if keys[group[0]] is not None and ans is not None:
+                self.answerCache.put(keys[group[0]],ans)
+        return answers
+
+    def _repeatSeeds(self,num,first=0):
+        ''' A different anonymizer seed for each of num repeats of a query, so that
+            each gets its own noise. None (fresh noise each time) if anonSeed is None.
+        '''
+        if self.anonSeed is None:
+            return [None] * num
+        return list(range(self.anonSeed + first,self.anonSeed + first + num))
+
+    def _rawDb(self):
+        if self.raw is None:
+            with self.trace.span('rawLoad'):
+                # Scaled databases are memory-mapped rather than loaded
+                inMemory = self.attack.get('rawInMemory',self.scaleFactor == 1)
+                self.raw = rawBackend.rawBackend(self.dbPath,inMemory=inMemory)
+        return self.raw
+
+    def _queryRaw(self,sql,params=()):
+        ''' Query on the local (not anonymized) database, answered from the column
+            statistics where possible and otherwise through the answer cache
+        '''
+        if not params:
+            ans = self._statsAnswer(sql)
+            if ans is not None:
+                return ans
+        key = self._answerKey(json.dumps([sql,list(params)]) if params else sql,'raw')
+        if key is not None:
+            ans = self.answerCache.get(key)
+            if ans is not None:
+                return ans
+        with self.trace.span('rawQuery',sql=sql) as span:
+            ans = self._rawDb().query(sql,params)
+            span.set(rows=len(ans))
+        if key is not None:
+            self.answerCache.put(key,ans)
+        return ans
+
+    def _anonRowsBatch(self,sqls,seeds=None):
+        ''' Like queryAnonBatch, but returns the rows of each answer '''
+        answers = self.queryAnonBatch(sqls,seeds=seeds)
+        if None in answers:
+            self._error(f'''ERROR: {self.attack['attackType']}: anonymized query failed''')
+        return [self._anonRows(ans) for ans in answers]
+
+    def _queryRawMany(self,sqls):
+        return [self._queryRaw(sql) for sql in sqls]
+
+    def _queryRawTemplate(self,template,val=None):
+        ''' Raw query of an attack template, with the -xx- placeholders and the ---
+            attack value bound as parameters, so the statement is prepared only once
+        '''
+        if self.stats is not None:
+            ans = self._statsAnswer(self._doSqlReplace(template).replace('---',str(val)))
+            if ans is not None:
+                return ans
+        if template not in self.compiled:
+            self.compiled[template] = rawBackend.compiledTemplate(template,self.rf.getNewRowColumn)
+        compiled = self.compiled[template]
+        return self._queryRaw(compiled.sql,compiled.bind(val))
+
+    def queryPlanned(self,sqls,anon=False,templates=None):
+        ''' Answers a family of count queries with as few scans as the planner allows.
+            Fusing anonymized queries changes what the anonymizer sees, so that is
+            only done when the attack sets 'fuseAnon'. templates optionally gives
+            the (template,val) each raw query was made from, so that queries that
+            can't be fused are run as prepared statements instead.
+        '''
+        if anon:
+            return queryPlanner.runPlanned(sqls,self._anonRowsBatch,
+                                           fuse=self.attack.get('fuseAnon',False))
+        if self.stats is not None:
+            answers = [self._statsAnswer(sql) for sql in sqls]
+            if None not in answers:
+                return answers
+        fallback = None
+        if templates is not None:
+            fallback = lambda: [self._queryRawTemplate(t,val) for t,val in templates]
+        return queryPlanner.runPlanned(sqls,self._queryRawMany,fallback=fallback)
+
+    def postDb(self,fileUrl=None):
+        ''' Streams the database to the upload endpoint. Compression, chunk size and
+            resumable (chunked) upload can be set with an 'uploadParams' entry in the
+            attack, see dbUploader.
+        '''
+        fileUrl = self.fileUrl if fileUrl is None else fileUrl
+        uploader = dbUploader(fileUrl,session=self.client.session,
+                              **self.attack.get('uploadParams',{}))
+        stats = uploader.upload(self.dbPath,self.dbName,self.dbHash)
+        print(stats['response'])
+        return stats
+
+    def postDelta(self,fileUrl=None):
+        ''' Ships the database as the shared base database (uploaded once) plus the
+            rows that this attack's changes deleted and inserted. Returns None if
+            the delta can't be computed, in which case the full database is sent.
+        '''
+        fileUrl = self.fileUrl if fileUrl is None else fileUrl
+        basePath = self.cache.baseDbPath(self.baseHash)
+        if self.scaleFactor > 1 or not os.path.exists(basePath):
+            return None
+        delta = dbDelta.computeDelta(basePath,self.dbPath)
+        if delta is None:
+            return None
+        baseName = f"base_{self.baseHash[:16]}.db"
+        stats = {'fileBytes':os.path.getsize(self.dbPath),'sentBytes':0}
+        if not self._serverHasDb(baseName,self.baseHash,fileUrl):
+            uploader = dbUploader(fileUrl,session=self.client.session,
+                                  **self.attack.get('uploadParams',{}))
+            stats['sentBytes'] += uploader.upload(basePath,baseName,self.baseHash)['sentBytes']
+        body = json.dumps(delta).encode()
+        headers = {'db-name':self.dbName,
+                   'db-hash':self.dbHash,
+                   'db-base':baseName,
+                   'password':'great success',
+                   'Content-Type':'application/json',
+                   }
+        r = self.client.session.post(url=fileUrl,data=body,headers=headers)
+        if r.status_code != 200:
+            print(f"delta upload failed ({r.status_code}), sending the full database")
+            return None
+        stats['sentBytes'] += len(body)
+        stats['response'] = r.text
+        print(f"uploaded {self.dbName} as {baseName} plus {len(body)} bytes of changes")
+        return stats
 
     def _error(self,msg):
-        print(msg)
-        self.pp.pprint(self.attack)
-        quit()
+        raise attackFailed(msg)
 
     def _simpleDifference(self,check=False):
-        if check:
-            # First run check to make sure that the attack works on raw data
-            sql1 = self._doSqlReplace(self.attack['attack1'])
-            ans1 = self.rf.queryDb(sql1)[0][0]
-            sql2 = self._doSqlReplace(self.attack['attack2'])
-            ans2 = self.rf.queryDb(sql2)[0][0]
-        else:
-            pass
+        # With check, first make sure that the attack works on raw data
+        templates = [(self.attack['attack1'],None),(self.attack['attack2'],None)]
+        sqls = [self._doSqlReplace(t) for t,_ in templates]
+        rows1,rows2 = self.queryPlanned(sqls,anon=not check,templates=templates)
+        ans1 = rows1[0][0]
+        ans2 = rows2[0][0]
         diff = ans1 - ans2
+        if not check:
+            print(f"anon: ans1 {ans1}, ans2 {ans2}, expected {self.attack['difference']}, got {diff}")
+            self.outcome = {'ans1':ans1,'ans2':ans2,'expected':self.attack['difference'],
+                            'got':diff,'correct':round(diff) == self.attack['difference']}
+            return True
         if ans1 <= 5 or ans2 <= 5 or diff != self.attack['difference']:
             self._error(f'''ERROR: {self.attack['attackType']}: failed check
                             ans1 {ans1}, ans2 {ans2}, expected {self.attack['difference']}, got {diff}''')
@@ -100,51 +544,45 @@ class runAttack:
         return True
 
     def _doSqlReplace(self,sql):
-        cols = re.findall('-..-',sql)
-        for col in cols:
-            val = self.rf.getNewRowColumn(col[1:3])
-            pattern = f"-{col[1:3]}-"
-            sql = re.sub(pattern,str(val),sql)
-        return sql
-
-    def _sortAnsByBucket(self,ans):
-        s = {}
-        for row in ans:
-            s[row[0]] = row[1]
-        return s
+        if sql not in self.replaced:
+            self.replaced[sql] = re.sub('-(..)-',lambda m: str(self.rf.getNewRowColumn(m.group(1))),sql)
+        return self.replaced[sql]
 
     def _simpleFirstDerivitiveDifference(self, check=False):
-        if check:
-            # First run check to make sure that the attack works on raw data
-            sql1 = self._doSqlReplace(self.attack['attack1'])
-            ans1 = self.rf.queryDb(sql1)
-            sql2 = self._doSqlReplace(self.attack['attack2'])
-            ans2 = self.rf.queryDb(sql2)
-        else:
-            pass
-        sort1 = self._sortAnsByBucket(ans1)
-        sort2 = self._sortAnsByBucket(ans2)
-        maxDiff = float('-inf')
-        maxBucket = None
-        for bucket,count1 in sort1.items():
-            if bucket in sort2:
-                count2 = sort2[bucket]
-                diff = count2 - count1
-                if diff > maxDiff:
-                    maxBucket = bucket
-                    maxDiff = diff
-        if maxBucket != self.attack['victimBucket']:
+        import bucketAnalysis
+        # With check, first make sure that the attack works on raw data
+        templates = [(self.attack['attack1'],None),(self.attack['attack2'],None)]
+        sqls = [self._doSqlReplace(t) for t,_ in templates]
+        ans1,ans2 = self.queryPlanned(sqls,anon=not check,templates=templates)
+        # All columns but the last (the count) identify the bucket
+        numKeys = len(ans1[0]) - 1 if len(ans1) > 0 else 1
+        noiseSd = None if check else self.attack.get('noiseSd')
+        diffs = bucketAnalysis.diffBuckets(ans1,ans2,numKeys=numKeys,noiseSd=noiseSd)
+        maxBucket = bucketAnalysis.maxBucket(diffs)
+        victimBucket = self.attack['victimBucket']
+        if isinstance(victimBucket,list):
+            victimBucket = tuple(victimBucket)
+        if not check:
+            print(f"anon: expected bucket {victimBucket}, got {maxBucket}")
+            self.outcome = {'expected':victimBucket,'got':maxBucket,
+                            'correct':maxBucket == victimBucket}
+            return True
+        if maxBucket != victimBucket:
             self._error(f'''ERROR: {self.attack['attackType']}: failed check
-                            ans1 {ans1}, ans2 {ans2}, expected {self.attack['victimBucket']}, got {maxBucket}''')
+                            top buckets {bucketAnalysis.topBuckets(diffs)}, expected {victimBucket}, got {maxBucket}''')
         return True
 
     def _simpleListUsers(self, check=False):
         if check:
             # First run check to make sure that the attack works on raw data
-            sql1 = self._doSqlReplace(self.attack['attack'])
-            ans1 = self.rf.queryDb(sql1)
+            ans1 = self._queryRawTemplate(self.attack['attack'])
         else:
-            pass
+            ans = self.queryAnon(self._doSqlReplace(self.attack['attack']))
+            # The anonymizer rejecting the query is a possible outcome, not an error
+            numRows = None if ans is None else len(self._anonRows(ans))
+            print(f"anon: query returned {'no answer' if numRows is None else f'{numRows} rows'}")
+            self.outcome = {'rows':numRows,'correct':bool(numRows)}
+            return True
         # TODO: deal with error or null responses from queryDb
         if len(ans1) < 1:
             self._error(f'''ERROR: {self.attack['attackType']}: failed check
@@ -154,36 +592,97 @@ class runAttack:
     def _simpleAveraging(self, check=False):
         # This query is on the raw data, so that we learn the expected exact answer
         sql1 = self._doSqlReplace(self.attack['attack'])
-        exactCount = self.rf.queryDb(sql1)[0][0]
+        exactCount = self._queryRawTemplate(self.attack['attack'])[0][0]
         if check:
             sumCounts = 0
             for _ in range(self.attack['repeats']):
-                sumCounts += self.rf.queryDb(sql1)[0][0]
+                sumCounts += self._queryRawTemplate(self.attack['attack'])[0][0]
             averagedCount = sumCounts / self.attack['repeats']
             if averagedCount != exactCount:
                 self._error(f'''ERROR: {self.attack['attackType']}: failed check
                                 got averaged count {averagedCount}, expected {exactCount}''')
             return True
-        pass
-        ans = self.queryAnon(sql1)
-        if ans is not None:
-            self.pp.pprint(ans)
+        if 'adaptive' in self.attack:
+            est = self._sequentialEstimate(sql1,**self.attack['adaptive'])
+            print(f"anon: estimated count {est['estimate']} (mean {est['mean']:.2f} +- "
+                  f"{est['halfWidth']:.2f}) from {est['queries']} queries, "
+                  f"{'converged' if est['converged'] else 'budget exhausted'}, "
+                  f"exact count {exactCount}")
+            self.outcome = {'expected':exactCount,'got':est['estimate'],
+                            'correct':est['estimate'] == exactCount,'queries':est['queries']}
+            return True
+        # The queries are independent, so they are sent concurrently. Each repeat
+        # needs its own seed, as repeats with the same seed get the same noise.
+        rows = self._anonRowsBatch([sql1] * self.attack['repeats'],
+                                   seeds=self._repeatSeeds(self.attack['repeats']))
+        averagedCount = sum([r[0][0] for r in rows]) / self.attack['repeats']
+        print(f"anon: got averaged count {averagedCount}, exact count {exactCount}")
+        self.outcome = {'expected':exactCount,'got':averagedCount,
+                        'correct':round(averagedCount) == exactCount}
         return True
 
+    def _sequentialEstimate(self,sql,batchSize=10,confidence=0.95,maxQueries=defaultNumSamples,
+                            minQueries=None,varySeed=True):
+        ''' Sends sql in batches, keeping a running mean and confidence interval of
+            the answers, and stops as soon as the interval pins down a single integer
+            or maxQueries have been sent. With varySeed each query gets its own
+            anonymizer seed. Without it the anonSeed must be None, so that each
+            query gets fresh noise. Returns the estimate and the number of queries
+            used.
+        '''
+        if not varySeed and self.anonSeed is not None:
+            self._error(f'''ERROR: {self.attack['attackType']}: varySeed=False with anonSeed
+                            {self.anonSeed} would average one noisy answer repeated''')
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        if minQueries is None:
+            minQueries = batchSize
+        n = 0
+        mean = 0.0
+        m2 = 0.0
+        halfWidth = float('inf')
+        converged = False
+        while n < maxQueries:
+            size = min(batchSize,maxQueries - n)
+            seeds = self._repeatSeeds(size,first=n) if varySeed else None
+            for rows in self._anonRowsBatch([sql] * size,seeds=seeds):
+                # Welford's running mean and variance
+                n += 1
+                delta = rows[0][0] - mean
+                mean += delta / n
+                m2 += delta * (rows[0][0] - mean)
+            if n < max(2,minQueries):
+                continue
+            halfWidth = z * math.sqrt(m2 / (n - 1) / n)
+            if m2 == 0:
+                # Identical answers say nothing about the noise, so keep sampling
+                continue
+            if round(mean - halfWidth) == round(mean + halfWidth) and halfWidth < 0.5:
+                converged = True
+                break
+        if m2 == 0 and n > 1:
+            print("WARNING: all answers were identical, the noise may not depend on the seed")
+        return {'estimate':round(mean),
+                'mean':mean,
+                'halfWidth':halfWidth,
+                'queries':n,
+                'converged':converged,
+                }
+
     def _splitAveraging(self, check=False):
         # This query is on the raw data, so that we learn the expected exact answer
-        sql = self._doSqlReplace(self.attack['checkQuery'])
-        exactCount = self.rf.queryDb(sql)[0][0]
-        if check:
-            sumCounts = 0
-            for val in self.attack['attackVals']:
-                sql1 = self.attack['attackTemplate1'].replace('---',str(val))
-                sumCounts += self.rf.queryDb(sql1)[0][0]
-                sql2 = self.attack['attackTemplate2'].replace('---',str(val))
-                sumCounts += self.rf.queryDb(sql2)[0][0]
-            averagedCount = sumCounts / len(self.attack['attackVals'])
-        else:
-            pass
+        exactCount = self._queryRawTemplate(self.attack['checkQuery'])[0][0]
+        templates = []
+        for val in self.attack['attackVals']:
+            templates.append((self.attack['attackTemplate1'],val))
+            templates.append((self.attack['attackTemplate2'],val))
+        sqls = [t.replace('---',str(val)) for t,val in templates]
+        rows = self.queryPlanned(sqls,anon=not check,templates=templates)
+        averagedCount = sum([r[0][0] for r in rows]) / len(self.attack['attackVals'])
+        if not check:
+            print(f"anon: got averaged count {averagedCount}, exact count {exactCount}")
+            self.outcome = {'expected':exactCount,'got':averagedCount,
+                            'correct':round(averagedCount) == exactCount}
+            return True
         if averagedCount != exactCount:
             self._error(f'''ERROR: {self.attack['attackType']}: failed check
                             got averaged count {averagedCount}, expected {exactCount}''')
@@ -198,267 +697,158 @@ class runAttack:
         'test': _test,
     }
 
-if True: testControl = 'firstOnly'    # executes only the first test
-elif False: testControl = 'tagged'    # executes only tests so tagged
-else: testControl = 'all'             # executes all tests
-
-''' List of Attacks '''
-attacks = [
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleAveraging',
-        'describe': 'Simple averaging attack to learn exact count',
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100",
-        'changes': [
-        ],
-        'attack': "select count(distinct aid1) from tab where t1='y'",
-        'repeats': 100,
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'splitAveraging',
-        'describe': 'Split averaging attack to learn exact count',
-        'conditionsSql': '''select count(*) from tab where t1='y' or
-                            i1 in (1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20)''',
-        'changes': [
-        ],
-        'checkQuery': "select count(distinct aid1) from tab where t1='y'",
-        'attackTemplate1': "select count(distinct aid1) from tab where t1='y' and i1 = ---",
-        'attackTemplate2': "select count(distinct aid1) from tab where t1='y' and i1 <> ---",
-        'attackVals': [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20],
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleListUsers',
-        'describe': 'Select star',
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100",
-        'changes': [
-        ],
-        'attack': "select * from tab",
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleFirstDerivitiveDifference',
-        'describe': '''First derivitive difference attack with NAND'd AND group,
-                       victim does not have attribute''',
-        # We want to learn which t1 bucket the victim is in
-        'conditionsSql': '''select count(*) from tab where t1 in ('a','b','c') or
-                            i1 = 100 or t2 = 'x' or t3 = 'y' ''',
-        # I want to make a scenario where the victim does not have t1=y.
-        'changes': [
-            {'change':'strip', 'table':'tab','query': "t2 == 'x' and i1 == 100 and t3 == 'y'"},
-            {'change':'append', 'table':'tab','spec': {'t1':['a'],'t2':['x'],'i1':[100],'t3':['y']}},
-        ],
-        # The first query definately has the user
-        'attack1': '''select t1, count(distinct aid1) from tab where
-                             not (i1 = 100 and t2 = 'x' and t3 = 'y') group by 1''',
-        'attack2': "select t1, count(distinct aid1) from tab group by 1",
-        'victimBucket': 'a',
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleFirstDerivitiveDifference',
-        'describe': 'First derivitive difference attack with single NAND, victim does not have attribute',
-        # We want to learn which t1 bucket the victim is in
-        'conditionsSql': "select count(*) from tab where t1 in ('a','b','c') and i1 = 100",
-        # I want to make a scenario where the victim does not have t1=y.
-        'changes': [
-            {'change':'append', 'table':'tab','spec': {'t1':['a'],'i1':['unique']}},
-        ],
-        # The first query definately has the user
-        'attack1': "select t1, count(distinct aid1) from tab where i1 <> -i1- group by 1",
-        'attack2': "select t1, count(distinct aid1) from tab group by 1",
-        'victimBucket': 'a',
-    },
-    {   
-        'doprint': False,
-        'tagAsRun': False,
-        'attackType': 'test',
-        'describe': 'Just testing a new conditionsSql',
-        # The attack here is where there is one user with t2 = 'f'. Want to learn t1
-        'conditionsSql': "select count(*) from tab where t1='y' and t2 in ('a','b','c')",
-        # Remove all t2='f' then add one back in
-        'changes': [
-            #{'change':'strip', 'table':'tab','query': "t2 == 'f'"},
-            #{'change':'append', 'table':'tab','spec': {'t1':['unique'],'t2':['f']}},
-        ],
-        # The first query definately excludes the victim
-        'attack1': "select count(distinct aid1) from tab where t1='y' and t2 = 'zz'",
-        # The second query may or may not (in this case does not).
-        'attack2': "select count(distinct aid1) from tab where t1='y'",
-        'difference': 0
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': 'Simple difference attack with lone woman, victim does not have attribute',
-        # The attack here is where there is one user with t2 = 'f'. Want to learn t1
-        'conditionsSql': "select count(*) from tab where t1='y' or t2 in ('f','m')",
-        # Remove all t2='f' then add one back in
-        'changes': [
-            {'change':'strip', 'table':'tab','query': "t2 == 'f'"},
-            {'change':'strip', 'table':'tab','query': "t2 == 'zz'"},
-            {'change':'append', 'table':'tab','spec': {'t1':['unique'],'t2':['f']}},
-        ],
-        # The first query definately excludes the victim
-        'attack1': "select count(distinct aid1) from tab where t1='y' and t2 = 'm'",
-        # The second query may or may not (in this case does not).
-        'attack2': "select count(distinct aid1) from tab where t1='y'",
-        'difference': 0
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': "Simple difference attack with NAND'd AND group, victim does not have attribute",
-        # The attack here is where there is one user with a unique combination of i1 and t2
-        # values, though each individually is not unique
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100 or t2='x'",
-        'changes': [
-            {'change':'strip', 'table':'tab','query': "t2 == 'x' and i1 == 100"},
-            {'change':'append', 'table':'tab','spec': {'t1':['unique'],'i1':[100],'t2':['x']}},
-        ],
-        # The first query definately excludes the victim
-        'attack1': "select count(distinct aid1) from tab where t1 = 'y' and not (i1 = 100 and t2 = 'x')",
-        # The second query may or may not (but in this case does not).
-        'attack2': "select count(distinct aid1) from tab where t1 = 'y'",
-        # If the second query has the victim, then the difference is 0
-        'difference': 0
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': "Simple difference attack with NAND'd AND group, victim has attribute",
-        # The attack here is where there is one user with a unique combination of i1 and t2
-        # values, though each individually is not unique
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100 or t2='x'",
-        'changes': [
-            {'change':'strip', 'table':'tab','query': "t2 == 'x' and i1 == 100"},
-            {'change':'append', 'table':'tab','spec': {'t1':['y'],'i1':[100],'t2':['x']}},
-        ],
-        # The first query definately excludes the victim
-        'attack1': "select count(distinct aid1) from tab where t1 = 'y' and not (i1 = 100 and t2 = 'x')",
-        # The second query may or may not (but in this case also does).
-        'attack2': "select count(distinct aid1) from tab where t1 = 'y'",
-        # If the second query has the victim, then the difference is 0
-        'difference': -1
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': 'Simple difference attack with single NAND, victim has attribute',
-        # The attack here is where there is one user with a unique value in column i1
-        # We want to know if that user has value t1='y' or not.
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100",
-        # I want to make a scenario where the victim has t1=y. So I add a row with unique
-        # i1 and t1='y'
-        'changes': [
-            {'change':'append', 'table':'tab','spec': {'aid1':['unique'],'t1':['y'],'i1':['unique']}},
-        ],
-        # The first query definately excludes the victim
-        'attack1': "select count(distinct aid1) from tab where t1 = 'y' and i1 <> -i1-",
-        # The second query may or may not (but in this case also does).
-        'attack2': "select count(distinct aid1) from tab where t1 = 'y'",
-        # If the second query has the victim, then the difference is -1
-        'difference': -1
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': 'Simple difference attack with single NAND, victim does not have attribute',
-        # The attack here is where there is one user with a unique i1. We want to know
-        # if that user has value t1='y' or not.
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100",
-        # I want to make a scenario where the victim does not have t1=y.
-        'changes': [
-            {'change':'append', 'table':'tab','spec': {'t1':['unique'],'i1':['unique']}},
-        ],
-        # The first query definately excludes the user
-        'attack1': "select count(distinct aid1) from tab where t1='y' and i1 <> -i1-",
-        # The second query may or may not (in this case does not).
-        'attack2': "select count(distinct aid1) from tab where t1='y'",
-        # If the second query does not have the victim, then the difference is 1
-        'difference': 0
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': "Simple difference attack with OR'd AND group, victim does not have attribute",
-        # The attack here is where there is one user with a unique combination of i1 and t2
-        # values, though each individually is not unique
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100 or t2='x'",
-        'changes': [
-            {'change':'strip', 'table':'tab','query': "t2 == 'x' and i1 == 100"},
-            {'change':'append', 'table':'tab','spec': {'t1':['unique'],'i1':[100],'t2':['x']}},
-        ],
-        # The first query definately has the victim
-        'attack1': "select count(distinct aid1) from tab where t1 = 'y' or (i1 = 100 and t2 = 'x')",
-        # The second query may or may not (but in this case does not).
-        'attack2': "select count(distinct aid1) from tab where t1 = 'y'",
-        # If the second query has the victim, then the difference is 0
-        'difference': 1
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': "Simple difference attack with OR'd AND group, victim has attribute",
-        # The attack here is where there is one user with a unique combination of i1 and t2
-        # values, though each individually is not unique
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100 or t2='x'",
-        'changes': [
-            {'change':'strip', 'table':'tab','query': "t2 == 'x' and i1 == 100"},
-            {'change':'append', 'table':'tab','spec': {'t1':['y'],'i1':[100],'t2':['x']}},
-        ],
-        # The first query definately has the victim
-        'attack1': "select count(distinct aid1) from tab where t1 = 'y' or (i1 = 100 and t2 = 'x')",
-        # The second query may or may not (but in this case also does).
-        'attack2': "select count(distinct aid1) from tab where t1 = 'y'",
-        # If the second query has the victim, then the difference is 0
-        'difference': 0
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': 'Simple difference attack with single OR, victim has attribute',
-        # The attack here is where there is one user with a unique value in column i1
-        # We want to know if that user has value t1='y' or not.
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=3456",
-        # I want to make a scenario where the victim has t1=y. So I add a row with unique
-        # i1 and t1='y'
-        'changes': [
-            {'change':'append', 'table':'tab','spec': {'aid1':['unique'],'t1':['y'],'i1':['unique']}},
-        ],
-        # The first query definately has the victim
-        'attack1': "select count(distinct aid1) from tab where t1 = 'y' or i1 = -i1-",
-        # The second query may or may not (but in this case also does).
-        'attack2': "select count(distinct aid1) from tab where t1 = 'y'",
-        # If the second query has the victim, then the difference is 0
-        'difference': 0
-    },
-    {   
-        'tagAsRun': False,
-        'attackType': 'simpleDifference',
-        'describe': 'Simple difference attack with single OR, victim does not have attribute',
-        # The attack here is where there is one user with a unique i1. We want to know
-        # if that user has value t1='y' or not.
-        'conditionsSql': "select count(*) from tab where t1='y' or i1=100",
-        # I want to make a scenario where the victim does not have t1=y.
-        'changes': [
-            {'change':'append', 'table':'tab','spec': {'t1':['unique'],'i1':['unique']}},
-        ],
-        # The first query definately has the user
-        'attack1': "select count(distinct aid1) from tab where t1='y' or i1 = -i1-",
-        # The second query may or may not (in this case does not).
-        'attack2': "select count(distinct aid1) from tab where t1='y'",
-        # If the second query does not have the victim, then the difference is 1
-        'difference': 1
-    },
-]
-
-for attack in attacks:
-    if (testControl == 'firstOnly' or testControl == 'all' or
-        (testControl == 'tagged' and attack['tagAsRun'])):
-        ra = runAttack(attack)
-        ra.runCheck()
-        ra.runAttack()
-    if testControl == 'firstOnly':
-        break
+def _uploadFile(path,dbName,dbHash,uploadParams,ep):
+    ''' Uploads a database file to the endpoint ep, for an endpointPool fail-over '''
+    dbUploader(ep.fileUrl,**uploadParams).upload(path,dbName,dbHash)
+
+def _initWorker():
+    ''' Give each pool worker a private working directory so that the database files
+        written by rowFiller in one worker can't be overwritten by another. The
+        directory is removed when the worker exits.
+    '''
+    # A relative trace path means the directory the suite was started from
+    if os.environ.get('ATTACK_TRACE'):
+        os.environ['ATTACK_TRACE'] = os.path.abspath(os.environ['ATTACK_TRACE'])
+    workDir = tempfile.mkdtemp(prefix='attackWorker_')
+    os.chdir(workDir)
+    # Pool workers leave through os._exit, which skips atexit, but runs these
+    multiprocessing.util.Finalize(None,shutil.rmtree,args=(workDir,),
+                                  kwargs={'ignore_errors':True},exitpriority=0)
+
+def _runOne(index,attack,queryUrl,fileUrl,doAttack,endpoints=None):
+    ''' Builds and runs one attack, and returns the outcome as a result dict '''
+    result = {'index':index,
+              'name':attack.get('name'),
+              'describe':attack['describe'],
+              'attackType':attack['attackType'],
+              'dbName':None,
+              'passed':False,
+              'error':None,
+              'elapsed':None,
+              }
+    start = time.perf_counter()
+    ra = None
+    try:
+        pool = None
+        if endpoints:
+            pool = endpointPool.getPool(endpoints,**attack.get('poolParams',{}))
+        ra = runAttack(attack,queryUrl=queryUrl,fileUrl=fileUrl,pool=pool)
+        result['dbName'] = ra.dbName
+        passed = ra.runCheck()
+        if doAttack:
+            passed = ra.runAttack() and passed
+        result['passed'] = passed
+        if ra.answerCache is not None:
+            result['answerCache'] = ra.answerCache.stats()
+        if pool is not None:
+            result['endpoints'] = pool.stats()
+        if ra.trace.enabled:
+            print(f"Time spent on: {attack['describe']}")
+            print(ra.trace.summary())
+    except attackFailed as e:
+        result['error'] = str(e)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        if ra is not None:
+            ra.close()
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+def _runGroup(group,queryUrl,fileUrl,doAttack,endpoints=None):
+    ''' Runs attacks that share their base tables in one worker, so that the base
+        tables are built once and each attack starts from a copy of them
+    '''
+    return [_runOne(index,attack,queryUrl,fileUrl,doAttack,endpoints)
+            for index,attack in group]
+
+def runSuite(attacks,numWorkers=defaultNumWorkers,doAttack=True,
+             queryUrl='https://db-proto.probsteide.com/api',
+             fileUrl='https://db-proto.probsteide.com/api/upload-db',endpoints=None):
+    ''' Runs the attacks over a pool of worker processes. Each attack gets its own
+        database name on the server. Attacks with the same conditionsSql go to the
+        same worker. Returns one result dict per attack, in the order of the
+        attacks list. endpoints is an optional list of (queryUrl,fileUrl) pairs
+        to spread the databases and queries over, in place of queryUrl/fileUrl.
+    '''
+    groups = {}
+    for index,attack in enumerate(attacks):
+        key = dbCache.baseHash(attack,attack.get('seed',dbCache.defaultSeed))
+        if attack.get('queryCacheDir') is not None:
+            # Workers run in their own temp dir, so resolve relative paths from here
+            attack = dict(attack,queryCacheDir=os.path.abspath(attack['queryCacheDir']))
+        groups.setdefault(key,[]).append((index,attack))
+    numWorkers = max(1,min(numWorkers,len(groups)))
+    with ProcessPoolExecutor(max_workers=numWorkers,initializer=_initWorker) as pool:
+        futures = [pool.submit(_runGroup,group,queryUrl,fileUrl,doAttack,endpoints)
+                   for group in groups.values()]
+        results = [result for future in futures for result in future.result()]
+    return sorted(results,key=lambda result: result['index'])
+
+defaultSpecDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'specs')
+
+def specName(path):
+    ''' The name of the spec in path: the file name without its order prefix,
+        so specs/07_diffNandAndGroupVictimHas.json is diffNandAndGroupVictimHas
+    '''
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r'^\d+_','',stem)
+
+def loadSpec(path):
+    with open(path) as f:
+        attack = json.load(f)
+    attack['name'] = specName(path)
+    return attack
+
+def loadSpecs(specDir=defaultSpecDir,names=None,tags=None,types=None):
+    ''' Returns the attack specs in specDir, in file name order, that have one of
+        the names, one of the tags and one of the attack types given. Selecting by
+        name only reads the selected files.
+    '''
+    paths = sorted([os.path.join(specDir,f) for f in os.listdir(specDir) if f.endswith('.json')])
+    if names is not None:
+        paths = [path for path in paths if specName(path) in names]
+    selected = []
+    for path in paths:
+        attack = loadSpec(path)
+        if tags is not None and not set(tags) & set(attack.get('tags',[])):
+            continue
+        if types is not None and attack['attackType'] not in types:
+            continue
+        selected.append(attack)
+    return selected
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run attacks from the spec directory. Without '
+                                     '--name, --tag, --type or --all only the first is run.')
+    parser.add_argument('--name',nargs='*',default=None,help='spec names to run')
+    parser.add_argument('--tag',nargs='*',default=None,help='run the specs with any of these tags')
+    parser.add_argument('--type',nargs='*',default=None,help='run the specs of these attack types')
+    parser.add_argument('--all',action='store_true',help='run every spec')
+    parser.add_argument('--specDir',default=defaultSpecDir)
+    parser.add_argument('--list',action='store_true',help='list the selected specs and exit')
+    parser.add_argument('--checkOnly',action='store_true',help='only check the attacks on raw data')
+    parser.add_argument('--workers',type=int,default=defaultNumWorkers)
+    parser.add_argument('--queryUrl',default='https://db-proto.probsteide.com/api')
+    parser.add_argument('--fileUrl',default='https://db-proto.probsteide.com/api/upload-db')
+    parser.add_argument('--endpoints',nargs='*',default=None,metavar='QUERYURL,FILEURL',
+                        help='servers to spread the databases over, in place of --queryUrl/--fileUrl')
+    args = parser.parse_args()
+    endpoints = None
+    if args.endpoints:
+        endpoints = [tuple(ep.split(',')) for ep in args.endpoints]
+        if any([len(ep) != 2 for ep in endpoints]):
+            parser.error('each of --endpoints must be queryUrl,fileUrl')
+    selected = loadSpecs(args.specDir,names=args.name,tags=args.tag,types=args.type)
+    if args.name is None and args.tag is None and args.type is None and not args.all:
+        selected = selected[:1]
+    if args.list:
+        for attack in selected:
+            print(f"{attack['name']:<40} {attack['attackType']:<32} {','.join(attack.get('tags',[]))}")
+        raise SystemExit(0)
+    pp = pprint.PrettyPrinter(indent=4)
+    for result in runSuite(selected,numWorkers=args.workers,doAttack=not args.checkOnly,
+                           queryUrl=args.queryUrl,fileUrl=args.fileUrl,endpoints=endpoints):
+        if not result['passed']:
+            print(f"FAILED: {result['describe']}")
+            pp.pprint(result)
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import attacks
+import endpointPool
+from standInServer import standInServer, gaussianNoise
+
+''' End-to-end benchmark of the attack harness against a local standInServer.
+    For every attack it records database build time, upload time, per-query
+    latency of the anonymized queries and the total time to build, check and
+    attack. Results are written as json so that runs can be compared with
+    --compare.
+'''
+
+def _gitCommit():
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def _latencyStats(latencies,count):
+    ''' count is the number of requests, latencies those of the most recent ones '''
+    if len(latencies) == 0:
+        return {'count':count}
+    latencies = sorted(latencies)
+    return {'count':count,
+            'mean':statistics.mean(latencies),
+            'median':statistics.median(latencies),
+            'p95':latencies[min(len(latencies)-1,int(0.95 * len(latencies)))],
+            'max':latencies[-1],
+            }
+
+def benchmarkAttack(index,attack,server,useCaches=False,pool=None):
+    ''' Runs one attack against the server, or against the endpoints of pool, and
+        returns its timing record
+    '''
+    attack = dict(attack)
+    if not useCaches:
+        attack['useDbCache'] = False
+        attack['useQueryCache'] = False
+    record = {'index':index,'describe':attack['describe'],'attackType':attack['attackType'],
+              'passed':False,'error':None}
+    start = time.perf_counter()
+    try:
+        ra = attacks.runAttack(attack,queryUrl=server.baseUrl() + '/api',
+                               fileUrl=server.baseUrl() + '/api/upload-db',pool=pool)
+        record.update(ra.timings)
+        checkStart = time.perf_counter()
+        ra.runCheck()
+        record['check'] = time.perf_counter() - checkStart
+        attackStart = time.perf_counter()
+        record['passed'] = ra.runAttack()
+        record['attack'] = time.perf_counter() - attackStart
+        record['queryLatency'] = _latencyStats(ra.client.latencies,ra.client.answered)
+        record['dbBytes'] = os.path.getsize(ra.dbPath)
+        ra.close()
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['total'] = time.perf_counter() - start
+    return record
+
+def runBenchmark(selected,noiseSd=1.0,latency=0.0,useCaches=False,numServers=1,replicas=1):
+    servers = [standInServer(noise=gaussianNoise(noiseSd),latency=latency).start()
+               for _ in range(numServers)]
+    pool = None
+    if numServers > 1:
+        pool = endpointPool.endpointPool([(s.baseUrl() + '/api',s.baseUrl() + '/api/upload-db')
+                                          for s in servers],replicas=replicas)
+    try:
+        records = [benchmarkAttack(index,attack,servers[0],useCaches,pool)
+                   for index,attack in selected]
+    finally:
+        if pool is not None:
+            pool.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    return {'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit':_gitCommit(),
+            'python':platform.python_version(),
+            'platform':platform.platform(),
+            'settings':{'noiseSd':noiseSd,'latency':latency,'useCaches':useCaches,
+                        'servers':numServers,'replicas':replicas},
+            'total':sum([r['total'] for r in records]),
+            'attacks':records,
+            'endpoints':pool.stats() if pool is not None else None,
+            }
+
+def compare(old,new):
+    ''' Prints the change in each timing between two benchmark results '''
+    oldByIndex = {r['index']:r for r in old['attacks']}
+    print(f"{'attack':>6} {'phase':>8} {'old':>9} {'new':>9} {'change':>8}")
+    for r in new['attacks']:
+        o = oldByIndex.get(r['index'])
+        if o is None:
+            continue
+        for phase in ['build','upload','check','attack','total']:
+            if phase in r and phase in o and o[phase] > 0:
+                change = 100 * (r[phase] - o[phase]) / o[phase]
+                print(f"{r['index']:>6} {phase:>8} {o[phase]:>9.3f} {r[phase]:>9.3f} {change:>7.1f}%")
+    print(f"{'all':>6} {'total':>8} {old['total']:>9.3f} {new['total']:>9.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the attack harness against a local stand-in server')
+    parser.add_argument('--out',default=None,help='results file (default bench_<time>.json)')
+    parser.add_argument('--compare',default=None,help='earlier results file to compare against')
+    parser.add_argument('--noiseSd',type=float,default=1.0)
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds added to each query')
+    parser.add_argument('--useCaches',action='store_true',help='allow database and answer caches')
+    parser.add_argument('--servers',type=int,default=1,help='number of stand-in servers')
+    parser.add_argument('--replicas',type=int,default=1,help='servers each database is placed on')
+    parser.add_argument('--only',type=int,nargs='*',default=None,help='indexes of attacks to run')
+    parser.add_argument('--name',nargs='*',default=None,help='spec names of attacks to run')
+    parser.add_argument('--tag',nargs='*',default=None,help='run the attacks with any of these tags')
+    parser.add_argument('--specDir',default=attacks.defaultSpecDir)
+    args = parser.parse_args()
+    specs = attacks.loadSpecs(args.specDir,names=args.name,tags=args.tag)
+    selected = [(i,a) for i,a in enumerate(specs) if args.only is None or i in args.only]
+    results = runBenchmark(selected,noiseSd=args.noiseSd,latency=args.latency,useCaches=args.useCaches,
+                           numServers=args.servers,replicas=args.replicas)
+    out = args.out if args.out is not None else f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(out,'w') as f:
+        json.dump(results,f,indent=2)
+    for r in results['attacks']:
+        status = 'ok' if r['passed'] else f"FAILED {r['error']}"
+        print(f"{r['index']:>3} {r['total']:>8.3f}s  {r['describe']}  {status}")
+    print(f"results written to {out}")
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f),results)
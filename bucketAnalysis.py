@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+''' Vectorized comparison of two bucketed (group by) answers. Each answer is a list
+    of rows whose first numKeys columns are the bucket and whose last column is
+    the count.
+'''
+
+def _toFrame(ans,numKeys,countName):
+    df = pd.DataFrame.from_records(list(ans))
+    keyCols = [f"k{i}" for i in range(numKeys)]
+    df = df.iloc[:,list(range(numKeys)) + [df.shape[1]-1]]
+    df.columns = keyCols + [countName]
+    return df,keyCols
+
+def diffBuckets(ans1,ans2,numKeys=1,noiseSd=None):
+    ''' Aligns the two answers on their bucket columns and returns a DataFrame with
+        count1, count2, diff (count2 - count1) and z, sorted by decreasing diff.
+        Only buckets present in both answers are kept. z is the difference in units
+        of the expected noise of a difference of two noisy counts. If noiseSd is not
+        given, the noise is estimated from the spread of the differences themselves,
+        and z is measured from their median rather than from zero.
+    '''
+    if len(ans1) == 0 or len(ans2) == 0:
+        return pd.DataFrame(columns=['count1','count2','diff','z'])
+    df1,keyCols = _toFrame(ans1,numKeys,'count1')
+    df2,_ = _toFrame(ans2,numKeys,'count2')
+    df = df1.merge(df2,on=keyCols,how='inner')
+    df['diff'] = df['count2'] - df['count1']
+    diffs = df['diff'].to_numpy(dtype=float)
+    if noiseSd is not None and noiseSd > 0:
+        center = 0.0
+        sd = noiseSd * np.sqrt(2)
+    else:
+        # Median absolute deviation, scaled to match a normal standard deviation
+        center = np.median(diffs) if len(diffs) else 0.0
+        sd = 1.4826 * np.median(np.abs(diffs - center)) if len(diffs) else 0.0
+    if sd > 0:
+        df['z'] = (diffs - center) / sd
+    else:
+        df['z'] = np.where(diffs > center,np.inf,np.where(diffs < center,-np.inf,0.0))
+    df = df.sort_values('diff',ascending=False,kind='mergesort')
+    return df.set_index(keyCols)
+
+def topBuckets(df,k=5):
+    ''' The k buckets with the largest difference, as (bucket,diff,z) tuples '''
+    top = df.iloc[:k]
+    return [(_key(bucket),diff,z) for bucket,diff,z in
+            zip(top.index.tolist(),top['diff'].tolist(),top['z'].tolist())]
+
+def maxBucket(df):
+    ''' The bucket with the largest difference, or None if there are no buckets.
+        Single column buckets are returned as a value, others as a tuple.
+    '''
+    if len(df) == 0:
+        return None
+    return _key(df.index[:1].tolist()[0])
+
+def _key(bucket):
+    return bucket[0] if isinstance(bucket,tuple) and len(bucket) == 1 else bucket
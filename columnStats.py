@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import sqlite3
+import itertools
+import queryPlanner
+
+''' Column statistics of an attack database, built once when the database is
+    created and kept next to it as json. For every table they hold the distinct
+    count of each column, a value histogram of each column with few enough
+    values, and the joint value counts of the columns that conditionsSql puts
+    conditions on. From these, simple count queries (conjunctions, disjunctions
+    and negations of comparisons, optionally grouped) are answered without
+    touching sqlite. Anything else returns None, and the caller runs the query.
+'''
+
+statsVersion = 1
+maxHistogramValues = 1000    # columns with more distinct values only get a distinct count
+maxJointGroups = 100000      # above this the condition columns are counted in pairs instead
+
+class _unanswerable(Exception):
+    pass
+
+def _quote(name):
+    return '"' + name.replace('"','""') + '"'
+
+def conditionColumns(conditionsSql,columns):
+    ''' The columns (of those given) that conditionsSql mentions outside of literals '''
+    text = re.sub(r"'(?:[^']|'')*'",' ',conditionsSql)
+    words = set(re.findall(r'\w+',text))
+    return [col for col in columns if col in words]
+
+def _groupCounts(conn,table,cols):
+    names = ','.join([_quote(col) for col in cols])
+    return conn.execute(f"select {names},count(*) from {_quote(table)} group by {names}").fetchall()
+
+def _tableStats(conn,table,conditionsSql,aidColumns):
+    columns = [row[1] for row in conn.execute(f"pragma table_info({_quote(table)})")]
+    numRows = conn.execute(f"select count(*) from {_quote(table)}").fetchone()[0]
+    stats = {'rows':numRows,'distinct':{},'histograms':{},'combos':[],'uniqueAids':[]}
+    for col in columns:
+        numDistinct = conn.execute(
+            f"select count(distinct {_quote(col)}) from {_quote(table)}").fetchone()[0]
+        stats['distinct'][col] = numDistinct
+        if numDistinct <= maxHistogramValues:
+            stats['histograms'][col] = [[val,n] for val,n in _groupCounts(conn,table,[col])]
+        # Distinct counts of an aid that is unique per row are row counts, so they add up
+        if col in aidColumns and numDistinct == numRows:
+            numNull = conn.execute(
+                f"select count(*) from {_quote(table)} where {_quote(col)} is null").fetchone()[0]
+            if numNull == 0:
+                stats['uniqueAids'].append(col)
+    condCols = [col for col in conditionColumns(conditionsSql,columns) if col not in aidColumns]
+    if len(condCols) > 1:
+        combos = [condCols]
+        groups = conn.execute(f"select count(*) from (select distinct "
+                              f"{','.join([_quote(c) for c in condCols])} "
+                              f"from {_quote(table)})").fetchone()[0]
+        if groups > maxJointGroups:
+            combos = [list(pair) for pair in itertools.combinations(condCols,2)]
+        for cols in combos:
+            counts = _groupCounts(conn,table,cols)
+            if len(counts) <= maxJointGroups:
+                stats['combos'].append({'columns':cols,
+                                        'counts':[[list(row[:-1]),row[-1]] for row in counts]})
+    return stats
+
+def buildStats(dbPath,conditionsSql,aidColumns,dbHash=None):
+    ''' Scans the database at dbPath and returns its statistics as a columnStats '''
+    conn = sqlite3.connect(f"file:{dbPath}?mode=ro",uri=True)
+    try:
+        tables = [row[0] for row in conn.execute(
+            "select name from sqlite_master where type = 'table' and name not like 'sqlite_%'")]
+        data = {'version':statsVersion,
+                'dbHash':dbHash,
+                'tables':{table:_tableStats(conn,table,conditionsSql,aidColumns)
+                          for table in tables},
+                }
+    finally:
+        conn.close()
+    return columnStats(data)
+
+tokenPattern = re.compile(r"\s*(?:('(?:[^']|'')*')|(-?\d+\.\d*|-?\d+)|(<>|!=|<=|>=|=|<|>|\(|\)|,)|(\w+))")
+
+def _tokens(where):
+    pos = 0
+    out = []
+    where = where.strip()
+    while pos < len(where):
+        m = tokenPattern.match(where,pos)
+        if m is None or m.end() == pos:
+            raise _unanswerable()
+        string,number,op,word = m.groups()
+        if string is not None:
+            out.append(('lit',string[1:-1].replace("''","'")))
+        elif number is not None:
+            out.append(('lit',float(number) if '.' in number else int(number)))
+        elif op is not None:
+            out.append(('op',op))
+        else:
+            out.append(('word',word.lower()) if word.lower() in ('and','or','not','in')
+                       else ('col',word))
+        pos = m.end()
+    return out
+
+class _parser:
+    ''' Recursive descent parser for the WHERE clauses that stats can answer. The
+        result is a nested tuple, evaluated by _evaluate().
+    '''
+    def __init__(self,where):
+        self.tokens = _tokens(where)
+        self.pos = 0
+        self.columns = set()
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None,None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise _unanswerable()
+        self.pos += 1
+        return token
+
+    def _expect(self,kind,val):
+        if self._next() != (kind,val):
+            raise _unanswerable()
+
+    def parse(self):
+        tree = self._or()
+        if self.pos != len(self.tokens):
+            raise _unanswerable()
+        return tree
+
+    def _or(self):
+        terms = [self._and()]
+        while self._peek() == ('word','or'):
+            self._next()
+            terms.append(self._and())
+        return terms[0] if len(terms) == 1 else ('or',terms)
+
+    def _and(self):
+        terms = [self._not()]
+        while self._peek() == ('word','and'):
+            self._next()
+            terms.append(self._not())
+        return terms[0] if len(terms) == 1 else ('and',terms)
+
+    def _not(self):
+        if self._peek() == ('word','not'):
+            self._next()
+            return ('not',self._not())
+        return self._primary()
+
+    def _operand(self):
+        kind,val = self._next()
+        if kind == 'col':
+            self.columns.add(val)
+            return ('col',val)
+        if kind == 'lit':
+            return ('lit',val)
+        raise _unanswerable()
+
+    def _primary(self):
+        if self._peek() == ('op','('):
+            self._next()
+            tree = self._or()
+            self._expect('op',')')
+            return tree
+        left = self._operand()
+        kind,val = self._peek()
+        if kind == 'op' and val in ('=','<>','!=','<','<=','>','>='):
+            self._next()
+            return ('cmp',val,left,self._operand())
+        negate = False
+        if (kind,val) == ('word','not'):
+            self._next()
+            negate = True
+            kind,val = self._peek()
+        if (kind,val) == ('word','in'):
+            self._next()
+            self._expect('op','(')
+            items = [self._operand()]
+            while self._peek() == ('op',','):
+                self._next()
+                items.append(self._operand())
+            self._expect('op',')')
+            tree = ('in',left,items)
+            return ('not',tree) if negate else tree
+        if negate:
+            raise _unanswerable()
+        return ('truth',left)
+
+def _value(operand,row):
+    kind,val = operand
+    return row[val] if kind == 'col' else val
+
+def _compare(op,a,b):
+    if a is None or b is None:
+        return None
+    # sqlite's affinity rules would convert between text and numbers, so leave those to sqlite
+    if isinstance(a,str) != isinstance(b,str) or isinstance(a,bytes) or isinstance(b,bytes):
+        raise _unanswerable()
+    if op == '=':
+        return a == b
+    if op in ('<>','!='):
+        return a != b
+    if op == '<':
+        return a < b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a >= b
+
+def _evaluate(tree,row):
+    ''' SQL three-valued logic, with None for unknown '''
+    kind = tree[0]
+    if kind in ('and','or'):
+        vals = [_evaluate(term,row) for term in tree[1]]
+        decisive = kind == 'or'
+        if decisive in vals:
+            return decisive
+        return None if None in vals else not decisive
+    if kind == 'not':
+        val = _evaluate(tree[1],row)
+        return None if val is None else not val
+    if kind == 'cmp':
+        return _compare(tree[1],_value(tree[2],row),_value(tree[3],row))
+    if kind == 'in':
+        vals = [_compare('=',_value(tree[1],row),_value(item,row)) for item in tree[2]]
+        if True in vals:
+            return True
+        return None if None in vals else False
+    val = _value(tree[1],row)
+    if val is None:
+        return None
+    if isinstance(val,(str,bytes)):
+        raise _unanswerable()
+    return val != 0
+
+class columnStats:
+    def __init__(self,data):
+        self.data = data
+        self.answered = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def load(path,dbHash=None):
+        ''' Returns the stats stored at path, or None if there are none for dbHash '''
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError,ValueError):
+            return None
+        if data.get('version') != statsVersion or (dbHash is not None and data.get('dbHash') != dbHash):
+            return None
+        return columnStats(data)
+
+    def save(self,path):
+        tmpPath = path + f".tmp{os.getpid()}"
+        with open(tmpPath,'w') as f:
+            json.dump(self.data,f,separators=(',',':'))
+        os.replace(tmpPath,path)
+
+    def distinct(self,table,col):
+        ''' Number of distinct values of the column, or None if it isn't known '''
+        return self.data['tables'].get(table,{}).get('distinct',{}).get(col)
+
+    def histogram(self,table,col):
+        ''' {value: rows} for the column, or None if it has too many values '''
+        hist = self.data['tables'].get(table,{}).get('histograms',{}).get(col)
+        return None if hist is None else {val:n for val,n in hist}
+
+    def valueCount(self,table,col,val):
+        ''' Number of rows with col = val, or None if the stats can't tell '''
+        hist = self.histogram(table,col)
+        if hist is None:
+            return None
+        return hist.get(val,0)
+
+    def _groups(self,table,cols):
+        ''' The smallest stored group counts that cover cols, as (row dicts,rows) '''
+        stats = self.data['tables'].get(table)
+        if stats is None:
+            return None
+        if len(cols) == 0:
+            return [({},stats['rows'])]
+        if len(cols) == 1:
+            col = next(iter(cols))
+            if col in stats['histograms']:
+                return [({col:val},n) for val,n in stats['histograms'][col]]
+        covering = [combo for combo in stats['combos'] if set(cols) <= set(combo['columns'])]
+        if len(covering) == 0:
+            return None
+        combo = min(covering,key=lambda combo: len(combo['counts']))
+        return [(dict(zip(combo['columns'],vals)),n) for vals,n in combo['counts']]
+
+    def answer(self,sql):
+        ''' The rows sql would return, if it is a count query the stats can answer.
+            Otherwise None.
+        '''
+        parsed = queryPlanner.parseCountQuery(sql)
+        if parsed is None:
+            self.fallbacks += 1
+            return None
+        try:
+            rows = self._answer(parsed)
+        except (_unanswerable,KeyError,TypeError):
+            rows = None
+        if rows is None:
+            self.fallbacks += 1
+        else:
+            self.answered += 1
+        return rows
+
+    def _answer(self,parsed):
+        table = parsed['table']
+        stats = self.data['tables'].get(table)
+        if stats is None:
+            return None
+        if parsed['distinct'] and parsed['col'] not in stats['uniqueAids']:
+            return None
+        if not parsed['distinct'] and parsed['col'] != '*':
+            return None
+        p = _parser(parsed['where'])
+        tree = p.parse()
+        groupCols = parsed['groupCols']
+        groups = self._groups(table,p.columns | set(groupCols))
+        if groups is None:
+            return None
+        counts = {}
+        for row,n in groups:
+            if _evaluate(tree,row) is True:
+                key = tuple([row[col] for col in groupCols])
+                counts[key] = counts.get(key,0) + n
+        if len(groupCols) == 0:
+            return [(counts.get((),0),)]
+        # Like sqlite, groups with no matching rows are left out
+        keys = sorted(counts,key=lambda key: [(v is not None,v) for v in key])
+        return [key + (counts[key],) for key in keys if counts[key] > 0]
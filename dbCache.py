@@ -0,0 +1,172 @@
+import os
+import copy
+import json
+import pickle
+import shutil
+import hashlib
+from collections import OrderedDict
+
+defaultCacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'dbCache')
+defaultSeed = 1              # seed for the random generators used to build the tables
+maxMemoEntries = 32          # rowFillers kept in memory by a long-running process
+maxScaledBytes = 20 * 1024**3    # scaled databases kept on disk, least recently used dropped first
+
+_memo = OrderedDict()
+_baseMemo = OrderedDict()
+
+def specHash(attack,seed=defaultSeed):
+    ''' Stable hash of everything that determines the contents of the attack database '''
+    spec = {'conditionsSql':attack['conditionsSql'],
+            'changes':attack['changes'],
+            'seed':seed,
+            }
+    if attack.get('scaleFactor',1) != 1:
+        spec['scaleFactor'] = attack['scaleFactor']
+    return hashlib.sha256(json.dumps(spec,sort_keys=True).encode()).hexdigest()
+
+def baseHash(attack,seed=defaultSeed):
+    ''' Hash of what determines the base tables, before any strip/append changes '''
+    return specHash({'conditionsSql':attack['conditionsSql'],'changes':[]},seed)
+
+class dbCache:
+    ''' On-disk cache of built attack databases, keyed by specHash(). Each entry is
+        the sqlite file plus the pickled rowFiller that built it (the rowFiller is
+        needed to query the database and to resolve the values of appended rows).
+        The most recently used rowFillers are also kept in memory, so that a
+        long-running process doesn't unpickle them again.
+    '''
+    def __init__(self,cacheDir=defaultCacheDir):
+        self.cacheDir = cacheDir
+        os.makedirs(cacheDir,exist_ok=True)
+
+    def _paths(self,key):
+        base = os.path.join(self.cacheDir,key)
+        return base + '.db', base + '.pkl'
+
+    def get(self,key):
+        ''' Returns the cached rowFiller with its database file restored to the place
+            the rowFiller expects it, or None if there is no entry for key
+        '''
+        dbPath,rfPath = self._paths(key)
+        if not os.path.exists(dbPath):
+            return None
+        rf = _memo.get(key)
+        if rf is None:
+            if not os.path.exists(rfPath):
+                return None
+            try:
+                with open(rfPath,'rb') as f:
+                    rf = pickle.load(f)
+            except Exception:
+                return None
+        self._remember(key,rf)
+        # Other attacks may have written their own database to the same path since
+        shutil.copyfile(dbPath,rf.getDbPath())
+        return rf
+
+    def _remember(self,key,rf,memo=_memo):
+        memo[key] = rf
+        memo.move_to_end(key)
+        while len(memo) > maxMemoEntries:
+            memo.popitem(last=False)
+
+    def scaledDbPath(self,key):
+        ''' Where the scaled-up database for key is kept (see scaleBuilder) '''
+        return os.path.join(self.cacheDir,key + '.scaled.db')
+
+    def pruneScaled(self,keep=None,maxBytes=None):
+        ''' Removes the least recently used scaled databases (by modification time)
+            until the rest fit in maxBytes. The file at keep is never removed.
+        '''
+        maxBytes = maxScaledBytes if maxBytes is None else maxBytes
+        files = []
+        for name in os.listdir(self.cacheDir):
+            if name.endswith('.scaled.db'):
+                path = os.path.join(self.cacheDir,name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime,st.st_size,path))
+        total = sum([size for _,size,_ in files])
+        for _,size,path in sorted(files):
+            if total <= maxBytes:
+                break
+            if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            print(f"dbCache: removed {os.path.basename(path)} to stay under {maxBytes} bytes")
+
+    def statsPath(self,key):
+        ''' Where the column statistics of the database with content hash key are kept '''
+        return os.path.join(self.cacheDir,key + '.stats.json')
+
+    def baseDbPath(self,key):
+        ''' Where the database of the base tables for key is kept '''
+        return os.path.join(self.cacheDir,key + '.base.db')
+
+    def getBase(self,key):
+        ''' Returns a private copy of the rowFiller holding the base tables for key,
+            before any changes, or None. The copy can be changed freely.
+        '''
+        rf = _baseMemo.get(key)
+        if rf is None:
+            path = os.path.join(self.cacheDir,key + '.base.pkl')
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path,'rb') as f:
+                    rf = pickle.load(f)
+            except Exception:
+                return None
+        self._remember(key,rf,_baseMemo)
+        return copy.deepcopy(rf)
+
+    def putBase(self,key,rf):
+        ''' Stores the rowFiller of the base tables, and writes their database to
+            baseDbPath(key). Changes rf's own database file.
+        '''
+        self._remember(key,copy.deepcopy(rf),_baseMemo)
+        rf.baseTablesToDb()
+        tmpSuffix = f".tmp{os.getpid()}"
+        shutil.copyfile(rf.getDbPath(),self.baseDbPath(key) + tmpSuffix)
+        os.replace(self.baseDbPath(key) + tmpSuffix,self.baseDbPath(key))
+        path = os.path.join(self.cacheDir,key + '.base.pkl')
+        try:
+            with open(path + tmpSuffix,'wb') as f:
+                pickle.dump(rf,f)
+        except Exception as e:
+            print(f"dbCache: can't store these base tables on disk ({e})")
+            os.remove(path + tmpSuffix)
+            return
+        os.replace(path + tmpSuffix,path)
+
+    def put(self,key,rf):
+        ''' Stores the rowFiller and its database. Files are written under temporary
+            names and renamed so that concurrent readers never see partial entries.
+        '''
+        dbPath,rfPath = self._paths(key)
+        tmpSuffix = f".tmp{os.getpid()}"
+        shutil.copyfile(rf.getDbPath(),dbPath + tmpSuffix)
+        os.replace(dbPath + tmpSuffix,dbPath)
+        self._remember(key,rf)
+        try:
+            with open(rfPath + tmpSuffix,'wb') as f:
+                pickle.dump(rf,f)
+        except Exception as e:
+            print(f"dbCache: can't store this attack on disk ({e})")
+            os.remove(rfPath + tmpSuffix)
+            return
+        os.replace(rfPath + tmpSuffix,rfPath)
+
+def fileHash(path):
+    ''' sha256 of the contents of the file at path '''
+    h = hashlib.sha256()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024),b''):
+            h.update(block)
+    return h.hexdigest()
@@ -0,0 +1,69 @@
+import sqlite3
+
+''' Row-level difference between two sqlite databases with the same tables, so that
+    a variant of a base database can be shipped as the base name plus a small patch.
+    Rows are compared on all of their columns, and a row that appears several times
+    is deleted or inserted as many times as its count differs.
+'''
+
+def _tables(conn,schema='main'):
+    return [r[0] for r in conn.execute(
+            f"select name from {schema}.sqlite_master where type = 'table' order by name")]
+
+def _columns(conn,table,schema='main'):
+    return [r[1] for r in conn.execute(f"pragma {schema}.table_info('{table}')")]
+
+def computeDelta(basePath,variantPath):
+    ''' Returns {table: {'columns', 'delete', 'insert'}} turning the base into the
+        variant, or None if the two don't have the same tables and columns
+    '''
+    conn = sqlite3.connect(f"file:{variantPath}?mode=ro",uri=True)
+    try:
+        conn.execute("attach database ? as base",(f"file:{basePath}?mode=ro",))
+        tables = _tables(conn)
+        if tables != _tables(conn,'base'):
+            return None
+        delta = {}
+        for table in tables:
+            columns = _columns(conn,table)
+            if columns != _columns(conn,table,'base'):
+                return None
+            cols = ', '.join([f'"{c}"' for c in columns])
+            # Base rows count +1 and variant rows -1, so what is left over per distinct
+            # row is how many more copies the base has than the variant
+            deleted = []
+            inserted = []
+            for row in conn.execute(f'select {cols}, sum(dbDelta_n) from '
+                                    f'(select {cols}, 1 as dbDelta_n from base."{table}" union all '
+                                    f'select {cols}, -1 as dbDelta_n from main."{table}") '
+                                    f'group by {cols} having sum(dbDelta_n) != 0'):
+                n = row[-1]
+                if n > 0:
+                    deleted.extend([row[:-1]] * n)
+                else:
+                    inserted.extend([row[:-1]] * -n)
+            if deleted or inserted:
+                delta[table] = {'columns':columns,
+                                'delete':[list(r) for r in deleted],
+                                'insert':[list(r) for r in inserted],
+                                }
+        return delta
+    finally:
+        conn.close()
+
+def applyDelta(path,delta):
+    ''' Applies a delta from computeDelta to the database at path, in place '''
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            for table,change in delta.items():
+                cols = ', '.join([f'"{c}"' for c in change['columns']])
+                match = ' and '.join([f'"{c}" is ?' for c in change['columns']])
+                places = ', '.join(['?'] * len(change['columns']))
+                conn.executemany(f'delete from "{table}" where rowid in '
+                                 f'(select rowid from "{table}" where {match} limit 1)',
+                                 change['delete'])
+                conn.executemany(f'insert into "{table}" ({cols}) values ({places})',
+                                 change['insert'])
+    finally:
+        conn.close()
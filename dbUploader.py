@@ -0,0 +1,163 @@
+import os
+import time
+import zlib
+import requests
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+defaultChunkSize = 4 * 1024 * 1024   # bytes read from the database file at a time
+defaultRetries = 3                   # number of times a failed chunk is re-sent
+defaultBackoff = 0.5                 # seconds before the first re-send, doubled on each one
+
+def _compressor(compression):
+    ''' Returns a function that compresses one chunk, and the Content-Encoding for it '''
+    if compression is None or compression == 'none':
+        return (lambda data: data), None
+    if compression == 'gzip':
+        return _gzip, 'gzip'
+    if compression == 'zstd':
+        if zstandard is None:
+            print("zstandard is not installed, falling back to gzip")
+            return _compressor('gzip')
+        cctx = zstandard.ZstdCompressor()
+        return cctx.compress, 'zstd'
+    raise ValueError(f"unknown compression {compression}")
+
+def _gzip(data):
+    c = zlib.compressobj(wbits=31)
+    return c.compress(data) + c.flush()
+
+def _checkResponse(r,what):
+    ''' Raises requests.HTTPError unless the server accepted the upload '''
+    if not 200 <= r.status_code < 300:
+        raise requests.HTTPError(f"{what} failed: {r.status_code} {r.text}",response=r)
+
+def _readChunks(path,chunkSize,start=0):
+    with open(path,'rb') as fin:
+        fin.seek(start)
+        while True:
+            data = fin.read(chunkSize)
+            if not data:
+                return
+            yield data
+
+class dbUploader:
+    ''' Uploads a database file to the upload endpoint without reading it into memory.
+
+        With resumable=False the file is sent as one streamed request body. With
+        resumable=True it is sent as numbered chunks, each its own request. Before
+        sending, the uploader asks the server (HEAD with an upload-id header) how many
+        chunks it already holds, and only sends the rest. The server answers with an
+        upload-chunks header. Each chunk is compressed on its own, so a chunk can be
+        re-sent without re-sending anything before it.
+    '''
+    def __init__(self,fileUrl,password='great success',chunkSize=defaultChunkSize,
+                 compression=None,resumable=False,retries=defaultRetries,session=None,
+                 backoff=defaultBackoff):
+        self.fileUrl = fileUrl
+        self.password = password
+        self.chunkSize = chunkSize
+        self.compress,self.encoding = _compressor(compression)
+        self.resumable = resumable
+        self.retries = retries
+        self.backoff = backoff
+        self.session = session if session is not None else requests.Session()
+
+    def _headers(self,dbName,dbHash):
+        headers = {'db-name':dbName,
+                   'password':self.password,
+                   'Content-Type':'application/octet-stream',
+                   }
+        if dbHash is not None:
+            headers['db-hash'] = dbHash
+        if self.encoding is not None:
+            headers['Content-Encoding'] = self.encoding
+        return headers
+
+    def upload(self,path,dbName,dbHash=None):
+        ''' Uploads the file at path. Returns a dict with the byte counts, elapsed time
+            and throughput, and the text of the last server response. Raises
+            requests.HTTPError if the server doesn't accept the upload.
+        '''
+        start = time.perf_counter()
+        if self.resumable:
+            stats = self._uploadChunks(path,dbName,dbHash)
+        else:
+            stats = self._uploadStream(path,dbName,dbHash)
+        stats['seconds'] = time.perf_counter() - start
+        stats['fileBytes'] = os.path.getsize(path)
+        stats['MBps'] = stats['fileBytes'] / max(stats['seconds'],1e-9) / 1e6
+        print(f"uploaded {dbName}: {stats['fileBytes']} bytes ({stats['sentBytes']} sent) "
+              f"in {stats['seconds']:.2f}s, {stats['MBps']:.2f} MB/s")
+        return stats
+
+    def _uploadStream(self,path,dbName,dbHash):
+        stats = {'sentBytes':0,'chunks':0,'resumedChunks':0}
+        headers = self._headers(dbName,dbHash)
+        if self.encoding is None:
+            # requests streams a file object and sets Content-Length from its size
+            with open(path,'rb') as fin:
+                r = self.session.post(url=self.fileUrl,data=fin,headers=headers)
+            stats['sentBytes'] = os.path.getsize(path)
+        else:
+            # One compression stream across the whole file, sent with chunked encoding
+            cobj = (zstandard.ZstdCompressor().compressobj() if self.encoding == 'zstd'
+                    else zlib.compressobj(wbits=31))
+            def body():
+                for data in _readChunks(path,self.chunkSize):
+                    out = cobj.compress(data)
+                    stats['sentBytes'] += len(out)
+                    stats['chunks'] += 1
+                    if out:
+                        yield out
+                out = cobj.flush()
+                stats['sentBytes'] += len(out)
+                yield out
+            r = self.session.post(url=self.fileUrl,data=body(),headers=headers)
+        _checkResponse(r,f"upload of {dbName}")
+        stats['response'] = r.text
+        return stats
+
+    def _chunksOnServer(self,uploadId,headers):
+        try:
+            r = self.session.head(url=self.fileUrl,headers=dict(headers,**{'upload-id':uploadId}),
+                                  timeout=10)
+            return int(r.headers.get('upload-chunks',0)) if r.status_code == 200 else 0
+        except (requests.RequestException,ValueError):
+            return 0
+
+    def _uploadChunks(self,path,dbName,dbHash):
+        stats = {'sentBytes':0,'chunks':0,'resumedChunks':0,'response':None}
+        fileBytes = os.path.getsize(path)
+        numChunks = max(1,-(-fileBytes // self.chunkSize))
+        uploadId = f"{dbName}-{dbHash if dbHash is not None else fileBytes}"
+        headers = self._headers(dbName,dbHash)
+        done = self._chunksOnServer(uploadId,headers)
+        stats['resumedChunks'] = done
+        for index,data in enumerate(_readChunks(path,self.chunkSize,start=done*self.chunkSize),
+                                    start=done):
+            body = self.compress(data)
+            chunkHeaders = dict(headers,**{'upload-id':uploadId,
+                                           'chunk-index':str(index),
+                                           'chunk-count':str(numChunks),
+                                           })
+            delay = self.backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    r = self.session.post(url=self.fileUrl,data=body,headers=chunkHeaders)
+                    # Only server errors are worth re-sending, a 4xx won't change
+                    if r.status_code < 500:
+                        break
+                except requests.RequestException:
+                    if attempt == self.retries:
+                        raise
+                if attempt < self.retries:
+                    time.sleep(delay)
+                    delay *= 2
+            _checkResponse(r,f"chunk {index} of {dbName}")
+            stats['sentBytes'] += len(body)
+            stats['chunks'] += 1
+            stats['response'] = r.text
+        return stats
@@ -0,0 +1,218 @@
+import json
+import time
+import hashlib
+import threading
+import requests
+from collections import deque
+
+defaultReplicas = 1          # endpoints each attack database is placed on
+defaultSlowSeconds = 5.0     # mean recent latency above which an endpoint is taken out
+defaultMaxFailures = 3       # consecutive failures before an endpoint is taken out
+defaultHealthInterval = 30   # seconds between health checks of endpoints out of rotation
+latencyWindow = 50           # recent latencies kept per endpoint for health decisions
+statsWindow = 10000          # latencies kept per endpoint for the percentiles in stats()
+
+class endpoint:
+    def __init__(self,queryUrl,fileUrl):
+        self.queryUrl = queryUrl
+        self.fileUrl = fileUrl
+        self.outstanding = 0
+        self.recent = deque(maxlen=latencyWindow)
+        self.requests = 0
+        self.latencies = deque(maxlen=statsWindow)
+        self.failures = 0
+        self.totalFailures = 0
+        self.healthy = True
+        self.lastCheck = 0.0
+
+class endpointPool:
+    ''' A set of query servers. Each attack database is placed on `replicas` of them,
+        chosen by rendezvous hashing of the database name so that every process
+        agrees on the placement. The endpoints a database was actually uploaded to
+        are recorded, and queries for it go to whichever of those has the fewest
+        requests outstanding. Endpoints that fail repeatedly or get slow are taken
+        out of rotation until a health check (a HEAD on the upload url, run by a
+        background thread) succeeds again. If none of a database's holders is in
+        rotation, the database is uploaded to another endpoint first.
+    '''
+    def __init__(self,endpoints,replicas=defaultReplicas,slowSeconds=defaultSlowSeconds,
+                 maxFailures=defaultMaxFailures,healthInterval=defaultHealthInterval):
+        ''' endpoints is a list of (queryUrl,fileUrl) pairs '''
+        self.endpoints = [endpoint(queryUrl,fileUrl) for queryUrl,fileUrl in endpoints]
+        self.replicas = max(1,min(replicas,len(self.endpoints)))
+        self.slowSeconds = slowSeconds
+        self.maxFailures = maxFailures
+        self.healthInterval = healthInterval
+        self.lock = threading.Lock()
+        self.moveLock = threading.Lock()    # one fail-over upload at a time
+        self.holders = {}       # dbName -> endpoints the database was uploaded to
+        self.uploaders = {}     # dbName -> function that uploads the database to an endpoint
+        self.checker = None
+        self.stopping = threading.Event()
+
+    def _ranked(self,dbName):
+        def score(ep):
+            return hashlib.sha256(f"{dbName}|{ep.queryUrl}".encode()).hexdigest()
+        return sorted(self.endpoints,key=score,reverse=True)
+
+    def place(self,dbName):
+        ''' The endpoints dbName should be uploaded to. Healthy endpoints are
+            preferred, but the placement only depends on dbName while all endpoints
+            are healthy.
+        '''
+        ranked = self._ranked(dbName)
+        healthy = [ep for ep in ranked if ep.healthy]
+        return (healthy + [ep for ep in ranked if not ep.healthy])[:self.replicas]
+
+    def uploaded(self,dbName,ep,uploader=None):
+        ''' Records that ep holds dbName. uploader(ep) puts the database on another
+            endpoint, if all of its holders drop out of rotation.
+        '''
+        with self.lock:
+            holders = self.holders.setdefault(dbName,[])
+            if ep not in holders:
+                holders.append(ep)
+            if uploader is not None:
+                self.uploaders[dbName] = uploader
+
+    def forget(self,dbName):
+        ''' Drops what is recorded about dbName, once it won't be queried again '''
+        with self.lock:
+            self.holders.pop(dbName,None)
+            self.uploaders.pop(dbName,None)
+
+    def missing(self,dbName,ep):
+        ''' Records that ep answered that it doesn't hold dbName '''
+        with self.lock:
+            if ep in self.holders.get(dbName,[]):
+                self.holders[dbName].remove(ep)
+
+    def _failOver(self,dbName):
+        ''' Uploads dbName to the best placed healthy endpoint that doesn't hold it,
+            and returns that endpoint, or None if that isn't possible
+        '''
+        uploader = self.uploaders.get(dbName)
+        if uploader is None:
+            return None
+        holders = self.holders.get(dbName,[])
+        for ep in self._ranked(dbName):
+            if ep.healthy and ep not in holders:
+                try:
+                    uploader(ep)
+                except Exception as e:
+                    print(f"can't move {dbName} to {ep.fileUrl}: {e}")
+                    continue
+                self.uploaded(dbName,ep)
+                print(f"{dbName} uploaded to {ep.fileUrl}, as no endpoint in rotation held it")
+                return ep
+        return None
+
+    def choose(self,dbName):
+        ''' The endpoint to send the next query on dbName to. Only endpoints that
+            hold dbName are chosen. Returns None if no endpoint holds it.
+        '''
+        with self.lock:
+            holders = list(self.holders.get(dbName,[]))
+        if not [ep for ep in holders if ep.healthy]:
+            with self.moveLock:
+                # Another query thread may have moved the database meanwhile
+                with self.lock:
+                    holders = list(self.holders.get(dbName,[]))
+                if not [ep for ep in holders if ep.healthy]:
+                    ep = self._failOver(dbName)
+                    if ep is not None:
+                        holders.append(ep)
+        candidates = [ep for ep in holders if ep.healthy] or holders
+        if len(candidates) == 0:
+            return None
+        with self.lock:
+            ep = min(candidates,key=lambda ep: ep.outstanding)
+            ep.outstanding += 1
+        return ep
+
+    def done(self,ep,seconds=None,ok=True):
+        ''' Records the outcome of a request started with choose() '''
+        with self.lock:
+            ep.outstanding -= 1
+            if ok:
+                ep.failures = 0
+                ep.recent.append(seconds)
+                ep.requests += 1
+                ep.latencies.append(seconds)
+                slow = (len(ep.recent) >= 5 and
+                        sum(ep.recent) / len(ep.recent) > self.slowSeconds)
+            else:
+                ep.failures += 1
+                ep.totalFailures += 1
+                slow = False
+            if slow or ep.failures >= self.maxFailures:
+                if ep.healthy:
+                    print(f"endpoint {ep.queryUrl} taken out of rotation")
+                ep.healthy = False
+                ep.lastCheck = time.time()
+                self._startChecker()
+
+    def _startChecker(self):
+        # Called with the lock held
+        if self.checker is None or not self.checker.is_alive():
+            self.checker = threading.Thread(target=self._checkLoop,daemon=True)
+            self.checker.start()
+
+    def _checkLoop(self):
+        while not self.stopping.wait(min(1.0,self.healthInterval)):
+            self.recheck()
+            with self.lock:
+                if all([ep.healthy for ep in self.endpoints]):
+                    self.checker = None
+                    return
+
+    def close(self):
+        self.stopping.set()
+
+    def recheck(self,force=False):
+        ''' Health checks the endpoints that are out of rotation and due a check.
+            Runs on the checker thread, not on the query path.
+        '''
+        now = time.time()
+        for ep in self.endpoints:
+            if ep.healthy or (not force and now - ep.lastCheck < self.healthInterval):
+                continue
+            ep.lastCheck = now
+            start = time.perf_counter()
+            try:
+                ok = requests.head(ep.fileUrl,timeout=self.slowSeconds).status_code < 500
+            except requests.RequestException:
+                ok = False
+            if ok and time.perf_counter() - start < self.slowSeconds:
+                with self.lock:
+                    ep.healthy = True
+                    ep.failures = 0
+                    ep.recent.clear()
+                print(f"endpoint {ep.queryUrl} back in rotation")
+
+    def stats(self):
+        ''' Per-endpoint request counts, failures and latency percentiles (over the
+            last statsWindow requests)
+        '''
+        out = {}
+        for ep in self.endpoints:
+            with self.lock:
+                lat = sorted(ep.latencies)
+            out[ep.queryUrl] = {'requests':ep.requests,
+                                'failures':ep.totalFailures,
+                                'outstanding':ep.outstanding,
+                                'healthy':ep.healthy,
+                                'mean':sum(lat) / len(lat) if lat else None,
+                                'p50':lat[len(lat) // 2] if lat else None,
+                                'p95':lat[min(len(lat) - 1,int(0.95 * len(lat)))] if lat else None,
+                                }
+        return out
+
+_pools = {}
+
+def getPool(endpoints,**kwargs):
+    ''' Returns the process-wide pool for this list of endpoints and settings '''
+    key = json.dumps([endpoints,kwargs],sort_keys=True)
+    if key not in _pools:
+        _pools[key] = endpointPool(endpoints,**kwargs)
+    return _pools[key]
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+defaultMaxEntries = 10000               # entries held in the in-memory tier
+defaultMaxDiskBytes = 512 * 1024 * 1024 # size of the on-disk tier before eviction
+
+def makeKey(dbHash,sql,anon,seed,aidCols):
+    ''' anon is True or False for the anonymizing endpoint, and 'raw' for queries
+        run directly against the local database
+    '''
+    spec = [dbHash,sql,anon,seed,aidCols]
+    return hashlib.sha256(json.dumps(spec).encode()).hexdigest()
+
+class queryCache:
+    ''' Two tier cache of query answers: an LRU dict in memory and, if cacheDir is
+        given, an sqlite file on disk that is trimmed back to maxDiskBytes by
+        dropping the least recently used entries.
+    '''
+    def __init__(self,maxEntries=defaultMaxEntries,cacheDir=None,maxDiskBytes=defaultMaxDiskBytes):
+        self.maxEntries = maxEntries
+        self.maxDiskBytes = maxDiskBytes
+        self.mem = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.disk = None
+        if cacheDir is not None:
+            os.makedirs(cacheDir,exist_ok=True)
+            self.disk = sqlite3.connect(os.path.join(cacheDir,'queryCache.sqlite'),
+                                        check_same_thread=False,isolation_level=None)
+            self.disk.execute('''create table if not exists answers
+                                 (key text primary key, value blob, size integer, used real)''')
+            self.diskBytes = self.disk.execute(
+                        'select coalesce(sum(size),0) from answers').fetchone()[0]
+
+    def _memPut(self,key,value):
+        self.mem[key] = value
+        self.mem.move_to_end(key)
+        while len(self.mem) > self.maxEntries:
+            self.mem.popitem(last=False)
+
+    def get(self,key):
+        ''' Returns the cached answer, or None '''
+        with self.lock:
+            if key in self.mem:
+                self.mem.move_to_end(key)
+                self.hits += 1
+                return self.mem[key]
+            if self.disk is not None:
+                row = self.disk.execute('select value from answers where key = ?',(key,)).fetchone()
+                if row is not None:
+                    self.disk.execute('update answers set used = ? where key = ?',(time.time(),key))
+                    value = pickle.loads(row[0])
+                    self._memPut(key,value)
+                    self.diskHits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self,key,value):
+        with self.lock:
+            self._memPut(key,value)
+            if self.disk is None:
+                return
+            blob = pickle.dumps(value)
+            old = self.disk.execute('select size from answers where key = ?',(key,)).fetchone()
+            if old is not None:
+                self.diskBytes -= old[0]
+            self.disk.execute('insert or replace into answers values (?,?,?,?)',
+                              (key,blob,len(blob),time.time()))
+            self.diskBytes += len(blob)
+            if self.diskBytes > self.maxDiskBytes:
+                self._evict()
+
+    def _evict(self):
+        rows = self.disk.execute('select key, size from answers order by used').fetchall()
+        self.disk.execute('begin')
+        for key,size in rows:
+            if self.diskBytes <= self.maxDiskBytes * 0.9:
+                break
+            self.disk.execute('delete from answers where key = ?',(key,))
+            self.diskBytes -= size
+        self.disk.execute('commit')
+
+    def stats(self):
+        return {'hits':self.hits,
+                'diskHits':self.diskHits,
+                'misses':self.misses,
+                'memEntries':len(self.mem),
+                'diskBytes':self.diskBytes if self.disk is not None else 0,
+                }
+
+_caches = {}
+
+def getCache(cacheDir=None):
+    ''' Returns the process-wide cache for cacheDir, so that every runAttack in a
+        process shares one memory tier
+    '''
+    if cacheDir not in _caches:
+        _caches[cacheDir] = queryCache(cacheDir=cacheDir)
+    return _caches[cacheDir]
@@ -0,0 +1,107 @@
+import re
+
+maxFusedColumns = 500        # keep well below the sqlite limit on result columns
+
+countQueryPattern = re.compile(r'''^\s*select\s+
+        (?:(?P<group>[\w\s,]+?)\s*,\s*)?
+        count\s*\(\s*(?P<distinct>distinct\s+)?(?P<col>\w+|\*)\s*\)\s+
+        from\s+(?P<table>\w+)
+        (?:\s+where\s+(?P<where>.*?))?
+        (?:\s+group\s+by\s+(?P<groupBy>[\d\s,]+))?
+        \s*$''',re.I|re.S|re.X)
+
+def parseCountQuery(sql):
+    ''' Returns the parts of a simple (optionally grouped) count query, or None if the
+        query is not of a form that the planner understands
+    '''
+    m = countQueryPattern.match(sql)
+    if m is None:
+        return None
+    group = m.group('group')
+    groupCols = [c.strip() for c in group.split(',')] if group else []
+    groupBy = m.group('groupBy')
+    if bool(groupCols) != bool(groupBy):
+        return None
+    if groupBy:
+        positions = [p.strip() for p in groupBy.split(',')]
+        if positions != [str(i+1) for i in range(len(groupCols))]:
+            return None
+    where = m.group('where')
+    if where is not None and re.search(r'\b(select|having|order|limit|union)\b',where,re.I):
+        return None
+    return {'groupCols':groupCols,
+            'distinct':m.group('distinct') is not None,
+            'col':m.group('col'),
+            'table':m.group('table'),
+            'where':where.strip() if where else '1',
+            }
+
+class fusedPlan:
+    ''' A set of count queries over the same table rewritten as conditional
+        aggregations, so that all of them are answered by a few scans
+    '''
+    def __init__(self,parsed):
+        self.parsed = parsed
+        self.groupCols = parsed[0]['groupCols']
+        self.table = parsed[0]['table']
+        self.chunks = [parsed[i:i+maxFusedColumns]
+                       for i in range(0,len(parsed),maxFusedColumns)]
+        self.sqls = [self._makeSql(chunk) for chunk in self.chunks]
+
+    def _makeSql(self,chunk):
+        cols = list(self.groupCols)
+        for p in chunk:
+            if p['distinct']:
+                cols.append(f"count(distinct case when ({p['where']}) then {p['col']} end)")
+            elif p['col'] == '*':
+                cols.append(f"coalesce(sum(case when ({p['where']}) then 1 else 0 end),0)")
+            else:
+                cols.append(f"count(case when ({p['where']}) then {p['col']} end)")
+            if self.groupCols:
+                # A group only appears in the individual answer if some row matched
+                cols.append(f"max(case when ({p['where']}) then 1 else 0 end)")
+        sql = f"select {', '.join(cols)} from {self.table}"
+        if self.groupCols:
+            positions = ', '.join([str(i+1) for i in range(len(self.groupCols))])
+            sql += f" group by {positions}"
+        return sql
+
+    def split(self,fusedAnswers):
+        ''' Turns the answers to the fused queries back into one answer per
+            original query, in the same row format as the individual queries
+        '''
+        numGroup = len(self.groupCols)
+        answers = []
+        for chunk,rows in zip(self.chunks,fusedAnswers):
+            for i in range(len(chunk)):
+                if numGroup == 0:
+                    answers.append([(rows[0][i],)])
+                    continue
+                countPos = numGroup + 2*i
+                answers.append([tuple(row[:numGroup]) + (row[countPos],)
+                                for row in rows if row[countPos+1]])
+        return answers
+
+def planQueries(sqls):
+    ''' Returns a fusedPlan for the queries, or None if they can't be fused '''
+    if len(sqls) < 2:
+        return None
+    parsed = [parseCountQuery(sql) for sql in sqls]
+    if None in parsed:
+        return None
+    first = parsed[0]
+    for p in parsed[1:]:
+        if p['table'] != first['table'] or p['groupCols'] != first['groupCols']:
+            return None
+    return fusedPlan(parsed)
+
+def runPlanned(sqls,queryFunc,fuse=True,fallback=None):
+    ''' Answers each of sqls using queryFunc, which takes a list of sql strings and
+        returns a list of row lists. Fusable families are sent as fused queries,
+        anything else falls back to the individual queries, or to fallback() if
+        given (which must return the same answers as queryFunc(sqls)).
+    '''
+    plan = planQueries(sqls) if fuse else None
+    if plan is None:
+        return fallback() if fallback is not None else queryFunc(sqls)
+    return plan.split(queryFunc(plan.sqls))
@@ -0,0 +1,99 @@
+import re
+import uuid
+import sqlite3
+import threading
+
+''' Raw (not anonymized) queries against a generated attack database. The database
+    is copied once into a shared in-memory database, or opened read-only and
+    memory-mapped, and each thread keeps its own read-only connection to it.
+    sqlite3 keeps a cache of prepared statements per connection, keyed by the SQL
+    text, so queries whose changing values are bound as parameters are parsed and
+    planned only once.
+'''
+
+defaultStatementCache = 512      # prepared statements kept per connection
+defaultMmapBytes = 1 << 30       # bytes memory-mapped when not loading into memory
+
+placeholderPattern = re.compile(r"'(?:[^']|'')*'|---|-(..)-")
+columnPattern = re.compile(r"-(..)-")
+
+def _plain(val):
+    ''' numpy scalars can't be bound, so convert them to python values '''
+    return val.item() if hasattr(val,'item') else val
+
+class compiledTemplate:
+    ''' An attack query with its -xx- placeholders (values of the appended row) and
+        --- placeholder (the attack value) turned into bound parameters. The -xx-
+        values are looked up once, when the template is compiled. A string literal
+        that is just a placeholder is bound as the value itself. Placeholders inside
+        a longer literal are filled in as text, as _doSqlReplace does, and the
+        literal is bound as a whole.
+    '''
+    def __init__(self,template,getNewRowColumn):
+        self.template = template
+        self.slots = []     # functions of the attack value giving each parameter
+        def fixed(val):
+            return lambda _: val
+        def replace(m):
+            token = m.group(0)
+            if token == '---':
+                self.slots.append(_plain)
+            elif m.group(1) is not None:
+                self.slots.append(fixed(_plain(getNewRowColumn(m.group(1)))))
+            else:
+                text = token[1:-1].replace("''","'")
+                if text == '---':
+                    self.slots.append(_plain)
+                elif columnPattern.fullmatch(text):
+                    self.slots.append(fixed(_plain(getNewRowColumn(text[1:3]))))
+                elif '---' in text or columnPattern.search(text):
+                    text = columnPattern.sub(lambda m: str(getNewRowColumn(m.group(1))),text)
+                    self.slots.append(lambda val,text=text: text.replace('---',str(val)))
+                else:
+                    return token
+            return '?'
+        self.sql = placeholderPattern.sub(replace,template)
+
+    def bind(self,val=None):
+        return tuple([slot(val) for slot in self.slots])
+
+class rawBackend:
+    def __init__(self,path,inMemory=True,mmapBytes=defaultMmapBytes):
+        self.path = path
+        self.inMemory = inMemory
+        self.mmapBytes = mmapBytes
+        self.local = threading.local()
+        self.anchor = None
+        if inMemory:
+            self.uri = f"file:rawdb_{uuid.uuid4().hex}?mode=memory&cache=shared"
+            # The shared in-memory database lives as long as one connection is open
+            self.anchor = sqlite3.connect(self.uri,uri=True,check_same_thread=False)
+            source = sqlite3.connect(f"file:{path}?mode=ro",uri=True)
+            source.backup(self.anchor)
+            source.close()
+        else:
+            self.uri = f"file:{path}?mode=ro"
+
+    def _connection(self):
+        conn = getattr(self.local,'conn',None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri,uri=True,cached_statements=defaultStatementCache)
+            conn.execute('pragma query_only = 1')
+            if self.inMemory:
+                conn.execute('pragma read_uncommitted = 1')
+            else:
+                conn.execute(f'pragma mmap_size = {self.mmapBytes}')
+            self.local.conn = conn
+        return conn
+
+    def query(self,sql,params=()):
+        return self._connection().execute(sql,params).fetchall()
+
+    def close(self):
+        conn = getattr(self.local,'conn',None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+        if self.anchor is not None:
+            self.anchor.close()
+            self.anchor = None
@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import pandas as pd
+
+''' Builds a scaled-up copy of an attack database. The variant database (base tables
+    plus the attack's changes) is copied once as is, and then scaleFactor-1 copies of
+    the base tables are added, each with fresh aid values. The strip queries of the
+    attack are applied to every copy, so the victim setup stays as it is in the
+    unscaled database. Rows are written in chunks inside transactions, and indexes
+    are created after loading, so memory use does not grow with scaleFactor.
+'''
+
+defaultChunkRows = 200000        # rows per insert transaction
+
+def _createStatements(conn,kind):
+    return [r for r in conn.execute(
+            "select name, tbl_name, sql from sqlite_master where type = ? and sql is not null",
+            (kind,))]
+
+def _shiftAids(df,aidCols,copy,stride):
+    for col in aidCols:
+        if col not in df.columns:
+            continue
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col] + copy * stride[col]
+        else:
+            df[col] = df[col].astype(str) + f"_{copy}"
+    return df
+
+def _aidStride(base,variant,table,aidCols):
+    ''' Offset between copies of integer aid columns, so no copy reuses an aid '''
+    stride = {}
+    for col in aidCols:
+        vals = [c.execute(f'select max("{col}") from "{table}"').fetchone()[0]
+                for c in (base,variant)
+                if col in [r[1] for r in c.execute(f"pragma table_info('{table}')")]]
+        vals = [v for v in vals if isinstance(v,int)]
+        stride[col] = max(vals) + 1 if vals else 0
+    return stride
+
+def scaleDb(basePath,variantPath,outPath,scaleFactor,aidCols,stripQueries=None,
+            chunkRows=defaultChunkRows):
+    ''' Writes the scaled database to outPath. stripQueries maps each table to the
+        pandas queries whose matching rows were stripped from it.
+    '''
+    stripQueries = stripQueries or {}
+    tmpPath = outPath + f".tmp{os.getpid()}"
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    base = sqlite3.connect(f"file:{basePath}?mode=ro",uri=True)
+    variant = sqlite3.connect(f"file:{variantPath}?mode=ro",uri=True)
+    out = sqlite3.connect(tmpPath,isolation_level=None)
+    try:
+        out.execute('pragma journal_mode = off')
+        out.execute('pragma synchronous = off')
+        for name,table,sql in _createStatements(variant,'table'):
+            out.execute(sql)
+            columns = [r[1] for r in variant.execute(f"pragma table_info('{table}')")]
+            insert = (f'insert into "{table}" values ({", ".join(["?"] * len(columns))})')
+            # The attack's own table, victim and all, is the first copy
+            out.execute('begin')
+            cur = variant.execute(f'select * from "{table}"')
+            while True:
+                rows = cur.fetchmany(chunkRows)
+                if not rows:
+                    break
+                out.executemany(insert,rows)
+            out.execute('commit')
+            baseDf = pd.read_sql_query(f'select * from "{table}"',base)
+            if len(baseDf) == 0:
+                continue
+            stride = _aidStride(base,variant,table,aidCols)
+            copiesPerChunk = max(1,chunkRows // len(baseDf))
+            for first in range(1,scaleFactor,copiesPerChunk):
+                copies = range(first,min(scaleFactor,first + copiesPerChunk))
+                chunk = pd.concat([_shiftAids(baseDf.copy(),aidCols,c,stride) for c in copies],
+                                  ignore_index=True)
+                for query in stripQueries.get(table,[]):
+                    chunk = chunk[~chunk.eval(query)]
+                out.execute('begin')
+                out.executemany(insert,chunk[columns].itertuples(index=False,name=None))
+                out.execute('commit')
+        for name,table,sql in _createStatements(variant,'index'):
+            out.execute(sql)
+        for table in [t for _,t,_ in _createStatements(variant,'table')]:
+            tableCols = [r[1] for r in out.execute(f"pragma table_info('{table}')")]
+            for col in aidCols:
+                if col in tableCols:
+                    out.execute(f'create index if not exists "{table}_{col}" on "{table}" ("{col}")')
+        out.execute('analyze')
+    finally:
+        base.close()
+        variant.close()
+        out.close()
+    os.replace(tmpPath,outPath)
+    return outPath
@@ -0,0 +1,308 @@
+import os
+import re
+import zlib
+import json
+import time
+import random
+import sqlite3
+import tempfile
+import shutil
+import threading
+import dbDelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+''' A local stand-in for the query server, so that the harness can be run and
+    measured without the remote endpoints. It implements the contracts used by
+    runAttack, anonClient and dbUploader:
+
+    POST /api             json {Anonymize, database, query, seed, aid_columns}, answered
+                          with {success, result: {columns, rows}} or {success, error}.
+                          With Anonymize, noise is added to aggregate columns: the
+                          select items that call count, sum or avg, whatever their
+                          alias.
+    HEAD /api/upload-db   with db-name: 200 with the stored db-hash as ETag, or 404
+                          with upload-id: 200 with upload-chunks (chunks received so far)
+    POST /api/upload-db   whole file body, or one chunk with upload-id, chunk-index
+                          and chunk-count headers. Bodies may be gzip or zstd encoded.
+                          With a db-base header, the body is a json dbDelta applied
+                          to a copy of that (already uploaded) database.
+'''
+
+queryPath = '/api'
+uploadPath = '/api/upload-db'
+aggregatePrefixes = ('count','sum','avg')
+aggregatePattern = re.compile(r'\b(?:count|sum|avg)\s*\(',re.I)
+_selectTokens = re.compile(r"'(?:[^']|'')*'|\(|\)|,|\bselect\b|\bfrom\b",re.I)
+
+def _selectItems(sql):
+    ''' The items of the outermost select list of sql, or None if there is none '''
+    depth = 0
+    start = None
+    items = []
+    for m in _selectTokens.finditer(sql):
+        token = m.group(0).lower()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth != 0 or token.startswith("'"):
+            continue
+        elif token == 'select' and start is None:
+            start = m.end()
+        elif token == ',' and start is not None:
+            items.append(sql[start:m.start()])
+            start = m.end()
+        elif token == 'from' and start is not None:
+            items.append(sql[start:m.start()])
+            return items
+    if start is None:
+        return None
+    items.append(sql[start:])
+    return items
+
+def aggregateColumns(sql,columns):
+    ''' Indexes of the result columns that hold aggregates. These are found from the
+        select list, and from the column names if the list can't be matched up with
+        the columns (as with select *).
+    '''
+    items = _selectItems(sql)
+    if items is None or len(items) != len(columns):
+        return [i for i,name in enumerate(columns) if name.lower().startswith(aggregatePrefixes)]
+    return [i for i,item in enumerate(items) if aggregatePattern.search(item)]
+
+def gaussianNoise(sd=1.0):
+    ''' Returns a noise function that adds rounded gaussian noise with the given
+        standard deviation. A noise function takes the true value and a seeded
+        random.Random, and returns the value to report.
+    '''
+    def noise(value,rng):
+        return value + int(round(rng.gauss(0,sd)))
+    return noise
+
+def noNoise(value,rng):
+    return value
+
+def _decode(data,encoding):
+    if encoding == 'gzip':
+        return zlib.decompress(data,wbits=31)
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+class standInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self,format,*args):
+        if self.server.verbose:
+            super().log_message(format,*args)
+
+    def _readBody(self):
+        if self.headers.get('Transfer-Encoding','').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(),16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            data = b''.join(parts)
+        else:
+            data = self.rfile.read(int(self.headers.get('Content-Length',0)))
+        return _decode(data,self.headers.get('Content-Encoding'))
+
+    def _reply(self,status,body=None,headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for key,val in (headers or {}).items():
+            self.send_header(key,val)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def do_HEAD(self):
+        if self.path != uploadPath:
+            return self._reply(404)
+        uploadId = self.headers.get('upload-id')
+        if uploadId is not None:
+            return self._reply(200,headers={'upload-chunks':str(self.server.chunksReceived(uploadId))})
+        dbHash = self.server.dbHashes.get(self.headers.get('db-name'))
+        if dbHash is None:
+            return self._reply(404,headers={'accepts-delta':'1'})
+        self._reply(200,headers={'ETag':f'"{dbHash}"','accepts-delta':'1'})
+
+    def do_POST(self):
+        if self.path == uploadPath:
+            return self._upload()
+        if self.path == queryPath:
+            return self._query()
+        self._reply(404,{'success':False,'error':f"unknown path {self.path}"})
+
+    def _query(self):
+        try:
+            req = json.loads(self._readBody())
+            columns,rows = self.server.runQuery(req)
+        except Exception as e:
+            return self._reply(200,{'success':False,'error':str(e)})
+        self.server.delay()
+        self._reply(200,{'success':True,
+                         'result':{'columns':[{'name':name} for name in columns],
+                                   'rows':rows}})
+
+    def _upload(self):
+        if self.headers.get('password') != self.server.password:
+            return self._reply(403,{'success':False,'error':'bad password'})
+        dbName = os.path.basename(self.headers.get('db-name',''))
+        if not dbName:
+            return self._reply(400,{'success':False,'error':'missing db-name'})
+        data = self._readBody()
+        baseName = self.headers.get('db-base')
+        if baseName is not None:
+            if not os.path.exists(self.server.dbPath(baseName)):
+                return self._reply(404,{'success':False,'error':f"unknown base {baseName}"})
+            self.server.storeDelta(dbName,baseName,json.loads(data),self.headers.get('db-hash'))
+            return self._reply(200,{'success':True,'base':baseName})
+        uploadId = self.headers.get('upload-id')
+        if uploadId is None:
+            self.server.storeDb(dbName,data,self.headers.get('db-hash'))
+            return self._reply(200,{'success':True,'bytes':len(data)})
+        index = int(self.headers['chunk-index'])
+        count = int(self.headers['chunk-count'])
+        if self.server.storeChunk(uploadId,index,count,dbName,data,self.headers.get('db-hash')):
+            return self._reply(200,{'success':True,'complete':True})
+        self._reply(200,{'success':True,'complete':False,'chunk':index})
+
+class standInServer(ThreadingHTTPServer):
+    ''' Holds the uploaded databases in dbDir. Without a dbDir they go to a temp
+        dir, removed by server_close().
+    '''
+    daemon_threads = True
+
+    def __init__(self,port=0,host='127.0.0.1',dbDir=None,password='great success',
+                 noise=None,latency=0.0,verbose=False,handler=standInHandler):
+        ''' noise is a noise function (see gaussianNoise). latency is a number of
+            seconds, or a function returning one, added to every query answer.
+        '''
+        super().__init__((host,port),handler)
+        self.ownsDbDir = dbDir is None
+        self.dbDir = dbDir if dbDir is not None else tempfile.mkdtemp(prefix='standIn_')
+        self.password = password
+        self.noise = noise if noise is not None else gaussianNoise()
+        self.latency = latency
+        self.verbose = verbose
+        self.dbHashes = {}
+        self.chunks = {}
+        self.lock = threading.Lock()
+
+    def baseUrl(self):
+        host,port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def dbPath(self,dbName):
+        return os.path.join(self.dbDir,os.path.basename(dbName))
+
+    def delay(self):
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency > 0:
+            time.sleep(latency)
+
+    def runQuery(self,req):
+        ''' Runs the query on a read-only connection to the named database. Returns
+            the column names and rows, with noise on the aggregate columns if the
+            request asks for anonymization.
+        '''
+        path = self.dbPath(req['database'])
+        if not os.path.exists(path):
+            raise ValueError(f"unknown database {req['database']}")
+        conn = sqlite3.connect(f"file:{path}?mode=ro",uri=True)
+        try:
+            cur = conn.execute(req['query'])
+            columns = [d[0] for d in cur.description]
+            rows = [list(row) for row in cur.fetchall()]
+        finally:
+            conn.close()
+        if not req.get('Anonymize',True):
+            return columns,rows
+        noisy = aggregateColumns(req['query'],columns)
+        seed = req.get('seed')
+        for row in rows:
+            # Same seed, query and bucket give the same noise. No seed gives fresh noise.
+            key = None if seed is None else json.dumps([seed,req['query'],
+                                [v for i,v in enumerate(row) if i not in noisy]])
+            rng = random.Random(key)
+            for i in noisy:
+                if isinstance(row[i],(int,float)):
+                    row[i] = self.noise(row[i],rng)
+        return columns,rows
+
+    def storeDb(self,dbName,data,dbHash):
+        tmpPath = self.dbPath(dbName) + f".tmp{threading.get_ident()}"
+        with open(tmpPath,'wb') as f:
+            f.write(data)
+        os.replace(tmpPath,self.dbPath(dbName))
+        with self.lock:
+            self.dbHashes[dbName] = dbHash
+
+    def storeDelta(self,dbName,baseName,delta,dbHash):
+        tmpPath = self.dbPath(dbName) + f".tmp{threading.get_ident()}"
+        shutil.copyfile(self.dbPath(baseName),tmpPath)
+        dbDelta.applyDelta(tmpPath,delta)
+        os.replace(tmpPath,self.dbPath(dbName))
+        with self.lock:
+            self.dbHashes[dbName] = dbHash
+
+    def chunksReceived(self,uploadId):
+        ''' Number of consecutive chunks, from the first, held for uploadId '''
+        with self.lock:
+            received = self.chunks.get(uploadId,{})
+            n = 0
+            while n in received:
+                n += 1
+            return n
+
+    def storeChunk(self,uploadId,index,count,dbName,data,dbHash):
+        ''' Returns True once all chunks are in and the database has been assembled '''
+        with self.lock:
+            received = self.chunks.setdefault(uploadId,{})
+            received[index] = data
+            if len(received) < count:
+                return False
+            del self.chunks[uploadId]
+        self.storeDb(dbName,b''.join([received[i] for i in range(count)]),dbHash)
+        return True
+
+    def start(self):
+        ''' Serves from a background thread. Returns self. '''
+        threading.Thread(target=self.serve_forever,daemon=True).start()
+        return self
+
+    def server_close(self):
+        super().server_close()
+        if self.ownsDbDir:
+            shutil.rmtree(self.dbDir,ignore_errors=True)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local stand-in for the attack query server')
+    parser.add_argument('--port',type=int,default=8000)
+    parser.add_argument('--dbDir',default=None)
+    parser.add_argument('--noiseSd',type=float,default=1.0)
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds added to each query')
+    args = parser.parse_args()
+    noise = gaussianNoise(args.noiseSd) if args.noiseSd > 0 else noNoise
+    server = standInServer(port=args.port,dbDir=args.dbDir,noise=noise,latency=args.latency,
+                           verbose=True)
+    print(f"serving on {server.baseUrl()}, databases in {server.dbDir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,71 @@
+import sqlite3
+import pytest
+import columnStats
+
+conditionsSql = "select count(*) from tab where t1 = 'a' and i1 = 1 and t2 = 'x'"
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("create table tab (aid1 integer, t1 text, t2 text, i1 integer)")
+        conn.executemany("insert into tab values (?,?,?,?)",[
+            (1,'a','x',1),(2,'a','y',None),(3,'b',None,2),(4,None,'x',1),
+            (5,'b','y',3),(6,None,None,None),(7,'a','x',2),(8,'c','y',1),
+        ])
+    conn.close()
+    return path
+
+def _sqlite(path,sql):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(sql).fetchall()
+    conn.close()
+    return rows
+
+queries = [
+    "select count(*) from tab",
+    "select count(*) from tab where t1 = 'a'",
+    "select count(*) from tab where t1 <> 'a'",
+    "select count(*) from tab where not t1 = 'a'",
+    "select count(*) from tab where i1 > 1",
+    "select count(*) from tab where i1 in (1,2)",
+    "select count(*) from tab where i1 not in (1,2)",
+    "select count(*) from tab where t1 in ('a','zz')",
+    "select count(*) from tab where t1 not in ('a')",
+    "select count(*) from tab where t1 = 'a' or i1 = 1",
+    "select count(*) from tab where not (t1 = 'a' or i1 = 1)",
+    "select count(*) from tab where t1 = 'a' and t2 = 'x' and i1 = 1",
+    "select count(*) from tab where (t1 = 'b' or t2 = 'x') and not i1 = 2",
+    "select count(distinct aid1) from tab where t2 = 'y' or i1 = 3",
+    "select count(*) from tab where t1 = 'zz'",
+    "select t1, count(*) from tab group by 1",
+    "select t1, count(*) from tab where i1 in (1,3) group by 1",
+    "select t2, count(distinct aid1) from tab where not t1 = 'a' group by 1",
+    "select i1, count(*) from tab where t1 = 'zz' group by 1",
+]
+
+@pytest.mark.parametrize('sql',queries)
+def test_answersMatchSqlite(db,sql):
+    stats = columnStats.buildStats(db,conditionsSql,['aid1'])
+    rows = stats.answer(sql)
+    assert rows is not None
+    assert rows == _sqlite(db,sql)
+
+@pytest.mark.parametrize('sql',[
+    "select count(*) from tab where t1 like 'a%'",
+    "select count(*) from tab where i1 = '1'",
+    "select count(distinct t1) from tab",
+    "select count(*) from tab where t1 = (select max(t1) from tab)",
+])
+def test_unanswerableFallsBack(db,sql):
+    stats = columnStats.buildStats(db,conditionsSql,['aid1'])
+    assert stats.answer(sql) is None
+    assert stats.fallbacks == 1 and stats.answered == 0
+
+def test_saveAndLoad(db,tmp_path):
+    stats = columnStats.buildStats(db,conditionsSql,['aid1'],dbHash='abc')
+    path = str(tmp_path / 'stats.json')
+    stats.save(path)
+    assert columnStats.columnStats.load(path,'abc').data == stats.data
+    assert columnStats.columnStats.load(path,'other') is None
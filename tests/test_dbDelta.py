@@ -0,0 +1,59 @@
+import sqlite3
+import pytest
+import dbDelta
+
+def _makeDb(path,rows,other=()):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("create table tab (aid1 integer, t1 text, f1 real)")
+        conn.execute("create table other (i1 integer)")
+        conn.executemany("insert into tab values (?,?,?)",rows)
+        conn.executemany("insert into other values (?)",[(i,) for i in other])
+    conn.close()
+    return str(path)
+
+def _rows(path,table='tab'):
+    conn = sqlite3.connect(path)
+    rows = sorted(conn.execute(f"select * from {table}").fetchall(),key=repr)
+    conn.close()
+    return rows
+
+def _roundTrip(tmp_path,baseRows,variantRows,baseOther=(),variantOther=()):
+    base = _makeDb(tmp_path / 'base.db',baseRows,baseOther)
+    variant = _makeDb(tmp_path / 'variant.db',variantRows,variantOther)
+    delta = dbDelta.computeDelta(base,variant)
+    assert delta is not None
+    dbDelta.applyDelta(base,delta)
+    assert _rows(base) == _rows(variant)
+    assert _rows(base,'other') == _rows(variant,'other')
+    return delta
+
+def test_roundTrip(tmp_path):
+    base = [(1,'a',1.5),(2,'b',None),(3,None,2.0)]
+    variant = [(1,'a',1.5),(3,None,2.0),(4,'d',0.0),(5,'e',None)]
+    delta = _roundTrip(tmp_path,base,variant,baseOther=[1,2],variantOther=[1,2])
+    assert set(delta) == {'tab'}
+    assert delta['tab']['delete'] == [[2,'b',None]]
+    assert sorted(delta['tab']['insert']) == [[4,'d',0.0],[5,'e',None]]
+
+def test_identicalDatabasesGiveEmptyDelta(tmp_path):
+    rows = [(1,'a',1.0),(1,'a',1.0)]
+    assert _roundTrip(tmp_path,rows,rows) == {}
+
+@pytest.mark.parametrize('base,variant',[
+    # Same distinct rows and row count, different multiplicities
+    ([(1,'r',None),(1,'r',None),(2,'s',None)],[(1,'r',None),(2,'s',None),(2,'s',None)]),
+    ([(1,'r',1.0)] * 3,[(1,'r',1.0)]),
+    ([(1,'r',1.0)],[(1,'r',1.0)] * 3),
+])
+def test_duplicateRows(tmp_path,base,variant):
+    delta = _roundTrip(tmp_path,base,variant)
+    assert delta != {}
+
+def test_differentSchemas(tmp_path):
+    base = _makeDb(tmp_path / 'base.db',[])
+    conn = sqlite3.connect(tmp_path / 'variant.db')
+    conn.execute("create table tab (aid1 integer, t1 text)")
+    conn.execute("create table other (i1 integer)")
+    conn.close()
+    assert dbDelta.computeDelta(base,str(tmp_path / 'variant.db')) is None
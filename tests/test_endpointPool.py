@@ -0,0 +1,125 @@
+import os
+import time
+import sqlite3
+import pytest
+import endpointPool
+import standInServer
+from anonClient import anonClient
+from dbUploader import dbUploader
+
+dbName = 'pooltest.db'
+
+@pytest.fixture
+def servers():
+    servers = [standInServer.standInServer(noise=standInServer.noNoise).start() for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def dbPath(tmp_path):
+    path = str(tmp_path / dbName)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("create table tab (aid1 integer, t1 text)")
+        conn.executemany("insert into tab values (?,?)",[(i,'a' if i % 2 else 'b') for i in range(10)])
+    conn.close()
+    return path
+
+def _pool(servers,**kwargs):
+    return endpointPool.endpointPool([(s.baseUrl() + standInServer.queryPath,
+                                       s.baseUrl() + standInServer.uploadPath) for s in servers],
+                                     **kwargs)
+
+def _upload(path):
+    return lambda ep: dbUploader(ep.fileUrl).upload(path,dbName)
+
+def _holds(server):
+    return os.path.exists(server.dbPath(dbName))
+
+def _query(client,n=1):
+    reqs = [{'Anonymize':True,'database':dbName,'query':"select count(*) from tab where t1 = 'a'",
+             'seed':None,'aid_columns':['aid1']} for _ in range(n)]
+    return client.queryBatch(reqs)
+
+def _answersOk(answers):
+    return all([ans is not None and ans['success'] and ans['result']['rows'] == [[5]]
+                for ans in answers])
+
+def test_routesOnlyToHolders(servers,dbPath):
+    pool = _pool(servers)
+    holder,other = pool.endpoints
+    _upload(dbPath)(holder)
+    pool.uploaded(dbName,holder,_upload(dbPath))
+    client = anonClient(None,pool=pool,backoff=0)
+    assert _answersOk(_query(client,20))
+    stats = pool.stats()
+    assert stats[holder.queryUrl]['requests'] == 20
+    assert stats[other.queryUrl]['requests'] == 0
+    assert not _holds(servers[1])
+    client.close()
+    pool.close()
+
+def test_unknownDatabaseDropsTheHolder(servers,dbPath):
+    pool = _pool(servers)
+    holder,other = pool.endpoints
+    _upload(dbPath)(holder)
+    pool.uploaded(dbName,holder,_upload(dbPath))
+    # Recorded as a holder, but the server never got the database
+    pool.uploaded(dbName,other)
+    client = anonClient(None,pool=pool,backoff=0)
+    assert _answersOk(_query(client,20))
+    assert pool.holders[dbName] == [holder]
+    assert other.healthy
+    client.close()
+    pool.close()
+
+def test_unknownDatabaseIsUploadedAgain(servers,dbPath):
+    pool = _pool(servers)
+    ep = pool.endpoints[0]
+    pool.uploaded(dbName,ep,_upload(dbPath))
+    client = anonClient(None,pool=pool,backoff=0)
+    assert _answersOk(_query(client))
+    assert len(pool.holders[dbName]) == 1
+    server = servers[pool.endpoints.index(pool.holders[dbName][0])]
+    assert _holds(server)
+    client.close()
+    pool.close()
+
+def test_leavesAndRejoinsRotation(servers,dbPath):
+    pool = _pool(servers,maxFailures=2,healthInterval=0.2)
+    a,b = pool.endpoints
+    for ep in (a,b):
+        _upload(dbPath)(ep)
+        pool.uploaded(dbName,ep,_upload(dbPath))
+    for _ in range(2):
+        # As if queries sent to a with choose() had failed
+        a.outstanding += 1
+        pool.done(a,ok=False)
+    assert not a.healthy
+    client = anonClient(None,pool=pool,backoff=0)
+    sent = a.requests
+    assert _answersOk(_query(client,10))
+    assert a.requests == sent
+    deadline = time.time() + 5
+    while not a.healthy and time.time() < deadline:
+        time.sleep(0.05)
+    assert a.healthy
+    client.close()
+    pool.close()
+
+def test_failOverWhenNoHolderIsInRotation(servers,dbPath):
+    pool = _pool(servers,healthInterval=3600)
+    a,b = pool.endpoints
+    _upload(dbPath)(a)
+    pool.uploaded(dbName,a,_upload(dbPath))
+    a.healthy = False
+    client = anonClient(None,pool=pool,backoff=0)
+    assert _answersOk(_query(client,5))
+    assert b in pool.holders[dbName]
+    assert _holds(servers[1])
+    pool.forget(dbName)
+    assert dbName not in pool.holders and dbName not in pool.uploaders
+    client.close()
+    pool.close()
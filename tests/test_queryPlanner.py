@@ -0,0 +1,57 @@
+import sqlite3
+import pytest
+import queryPlanner
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("create table tab (aid1 integer, t1 text, i1 integer)")
+    conn.executemany("insert into tab values (?,?,?)",
+                     [(1,'a',1),(2,'a',2),(3,'b',2),(4,'b',None),(5,None,3),(5,'c',3)])
+    yield conn
+    conn.close()
+
+def _queryFunc(conn):
+    return lambda sqls: [conn.execute(sql).fetchall() for sql in sqls]
+
+ungrouped = [
+    "select count(*) from tab",
+    "select count(*) from tab where t1 = 'a'",
+    "select count(*) from tab where t1 = 'z'",
+    "select count(distinct aid1) from tab where i1 = 3",
+    "select count(distinct aid1) from tab where i1 = 99",
+    "select count(i1) from tab where t1 <> 'a'",
+]
+
+grouped = [
+    "select t1, count(*) from tab group by 1",
+    "select t1, count(*) from tab where i1 = 2 group by 1",
+    "select t1, count(*) from tab where i1 = 99 group by 1",
+    "select t1, count(distinct aid1) from tab where i1 is null or i1 = 3 group by 1",
+]
+
+@pytest.mark.parametrize('sqls',[ungrouped,grouped])
+def test_fusedAnswersMatchIndividual(conn,sqls):
+    plan = queryPlanner.planQueries(sqls)
+    assert plan is not None
+    assert len(plan.sqls) == 1
+    fused = queryPlanner.runPlanned(sqls,_queryFunc(conn))
+    assert fused == _queryFunc(conn)(sqls)
+
+def test_emptyGroupsAreLeftOut(conn):
+    sqls = grouped[1:3]
+    fused = queryPlanner.runPlanned(sqls,_queryFunc(conn))
+    assert fused == [[('a',1),('b',1)],[]]
+
+def test_chunksOverMaxColumns(conn,monkeypatch):
+    monkeypatch.setattr(queryPlanner,'maxFusedColumns',2)
+    plan = queryPlanner.planQueries(ungrouped)
+    assert len(plan.sqls) == 3
+    assert queryPlanner.runPlanned(ungrouped,_queryFunc(conn)) == _queryFunc(conn)(ungrouped)
+
+def test_unfusableFallsBack(conn):
+    sqls = ["select count(*) from tab","select t1, count(*) from tab group by 1"]
+    assert queryPlanner.planQueries(sqls) is None
+    calls = []
+    answers = queryPlanner.runPlanned(sqls,_queryFunc(conn),fallback=lambda: calls.append(1) or [])
+    assert calls == [1] and answers == []
@@ -0,0 +1,46 @@
+import types
+import sqlite3
+import pytest
+import attacks
+import rawBackend
+
+newRow = {'t1':'zz','i1':7,'t2':'q-w'}
+
+class _rowFiller:
+    def getNewRowColumn(self,col):
+        return newRow[col]
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("create table tab (aid1 integer, t1 text, i1 integer, t2 text)")
+    conn.executemany("insert into tab values (?,?,?,?)",[
+        (1,'zz',7,'q-w'),(2,'---x',3,'a'),(3,'5',5,'zz5'),(4,'b',5,'it''s'),
+        (5,'zz',1,'---'),(6,'3-zz',2,'q-w'),
+    ])
+    yield conn
+    conn.close()
+
+def _textSql(template,val):
+    # What the attack would send as text, see runAttack._doSqlReplace
+    ra = types.SimpleNamespace(replaced={},rf=_rowFiller())
+    return attacks.runAttack._doSqlReplace(ra,template).replace('---',str(val))
+
+@pytest.mark.parametrize('template',[
+    "select count(*) from tab where t1 = '-t1-' or i1 = -i1-",
+    "select count(*) from tab where i1 = --- and t1 <> '-t1-'",
+    "select count(*) from tab where t1 = '---'",
+    "select count(*) from tab where t1 like '---%'",
+    "select count(*) from tab where t2 like '%-t1-%' or t2 = '---'",
+    "select count(*) from tab where t1 = '---' || '-' || '-t1-'",
+    "select count(*) from tab where t2 = 'it''s' and i1 = ---",
+    "select count(*) from tab where t2 = '-t2-'",
+    "select t1, count(*) from tab where i1 <> --- group by 1",
+])
+@pytest.mark.parametrize('val',[3,5])
+def test_compiledMatchesText(conn,template,val):
+    compiled = rawBackend.compiledTemplate(template,_rowFiller().getNewRowColumn)
+    params = compiled.bind(val)
+    assert compiled.sql.count('?') == len(params)
+    bound = conn.execute(compiled.sql,params).fetchall()
+    assert bound == conn.execute(_textSql(template,val)).fetchall()
@@ -0,0 +1,69 @@
+import random
+import pytest
+import attacks
+
+class _fakeAnon:
+    ''' Stands in for runAttack._anonRowsBatch: answers trueCount plus gaussian
+        noise, seeded by the query seed, or fresh noise for a seed of None
+    '''
+    def __init__(self,trueCount=20,sd=1.0):
+        self.trueCount = trueCount
+        self.sd = sd
+        self.seeds = []
+        self.fresh = random.Random(12345)
+
+    def __call__(self,sqls,seeds=None):
+        seeds = [None] * len(sqls) if seeds is None else list(seeds)
+        self.seeds.extend(seeds)
+        rows = []
+        for seed in seeds:
+            rng = self.fresh if seed is None else random.Random(seed)
+            rows.append([(self.trueCount + rng.gauss(0,self.sd),)])
+        return rows
+
+def _runAttack(anon,anonSeed=1):
+    ra = attacks.runAttack.__new__(attacks.runAttack)
+    ra.attack = {'attackType':'simpleAveraging'}
+    ra.anonSeed = anonSeed
+    ra._anonRowsBatch = anon
+    return ra
+
+def test_convergesEarlyUnderLowNoise():
+    anon = _fakeAnon(sd=1.0)
+    est = _runAttack(anon)._sequentialEstimate('q',maxQueries=500)
+    assert est['converged']
+    assert est['estimate'] == 20
+    assert est['queries'] < 100
+    assert len(anon.seeds) == est['queries']
+
+def test_stopsAtMaxQueries():
+    anon = _fakeAnon(sd=10.0)
+    est = _runAttack(anon)._sequentialEstimate('q',batchSize=7,maxQueries=50)
+    assert not est['converged']
+    assert est['queries'] == 50
+    assert len(anon.seeds) == 50
+
+def test_identicalAnswersNeverConverge():
+    anon = _fakeAnon(sd=0.0)
+    est = _runAttack(anon)._sequentialEstimate('q',maxQueries=40)
+    assert not est['converged']
+    assert est['queries'] == 40
+
+def test_seedsDifferAcrossBatches():
+    anon = _fakeAnon()
+    _runAttack(anon,anonSeed=100)._sequentialEstimate('q',batchSize=5,maxQueries=20,minQueries=20)
+    assert anon.seeds == list(range(100,120))
+
+def test_noSeedGivesFreshNoise():
+    anon = _fakeAnon()
+    est = _runAttack(anon,anonSeed=None)._sequentialEstimate('q',maxQueries=30,varySeed=False)
+    assert anon.seeds == [None] * est['queries']
+    anon = _fakeAnon()
+    _runAttack(anon,anonSeed=None)._sequentialEstimate('q',maxQueries=30)
+    assert set(anon.seeds) == {None}
+
+def test_fixedSeedWithoutVarySeedIsRefused():
+    anon = _fakeAnon()
+    with pytest.raises(attacks.attackFailed):
+        _runAttack(anon,anonSeed=1)._sequentialEstimate('q',varySeed=False)
+    assert anon.seeds == []
@@ -0,0 +1,17 @@
+import pytest
+import standInServer
+
+@pytest.mark.parametrize('sql,columns,noisy',[
+    ("select count(*) from tab",['count(*)'],[0]),
+    ("select count(*) as n from tab",['n'],[0]),
+    ("select t1, count(distinct aid1) as users from tab group by 1",['t1','users'],[1]),
+    # The planner's fused columns, with the per-group match flag left exact
+    ("select t1, coalesce(sum(case when (t1 = 'a, b') then 1 else 0 end),0), "
+     "max(case when (t1 = 'a, b') then 1 else 0 end) from tab group by 1",['t1','x','y'],[1]),
+    ("select i1 from tab where i1 in (select max(i1) from tab)",['i1'],[]),
+    ("select avg(i1) n1, sum(i1) n2, i1 from tab group by 3",['n1','n2','i1'],[0,1]),
+    # select * can't be matched up with the columns, so names decide
+    ("select * from tab",['count_a','t1'],[0]),
+])
+def test_aggregateColumns(sql,columns,noisy):
+    assert standInServer.aggregateColumns(sql,columns) == noisy
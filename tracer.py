@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import threading
+
+''' Opt-in timing of the phases of an attack run. Tracing is enabled by setting the
+    ATTACK_TRACE environment variable to the path of a JSONL file (or by calling
+    enableTracing), which also makes it apply in runSuite's worker processes.
+    When disabled, span() returns a shared do-nothing object.
+'''
+
+class _nullSpan:
+    def __enter__(self):
+        return self
+    def __exit__(self,*exc):
+        return False
+    def set(self,**attrs):
+        pass
+
+_nullSpanInstance = _nullSpan()
+
+class span:
+    def __init__(self,tracer,name,attack,attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attack = attack
+        self.attrs = attrs
+
+    def set(self,**attrs):
+        ''' Adds attributes (byte counts, row counts, status...) to the span '''
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self,excType,exc,tb):
+        record = {'attack':self.attack,
+                  'name':self.name,
+                  'start':self.start,
+                  'duration':time.perf_counter() - self.t0,
+                  'pid':os.getpid(),
+                  'thread':threading.get_ident(),
+                  }
+        if excType is not None:
+            record['error'] = f"{excType.__name__}: {exc}"
+        record.update(self.attrs)
+        self.tracer.record(record)
+        return False
+
+class tracer:
+    ''' Appends each span as a line of json to path, and keeps the count and total
+        seconds per attack and span name for summary()
+    '''
+    def __init__(self,path=None):
+        self.path = path
+        self.enabled = path is not None
+        self.totals = {}
+        self.file = None
+        self.filePid = None
+        self.lock = threading.Lock()
+
+    def span(self,name,attack=None,**attrs):
+        if not self.enabled:
+            return _nullSpanInstance
+        return span(self,name,attack,attrs)
+
+    def forAttack(self,attack):
+        ''' A view of the tracer that labels every span with the attack '''
+        return attackTracer(self,attack)
+
+    def _out(self):
+        # A forked worker opens its own handle rather than sharing the parent's
+        if self.file is None or self.filePid != os.getpid():
+            self.file = open(self.path,'a')
+            self.filePid = os.getpid()
+        return self.file
+
+    def record(self,record):
+        line = json.dumps(record,default=str) + '\n'
+        with self.lock:
+            t = self.totals.setdefault(record['attack'],{}).setdefault(record['name'],[0,0.0])
+            t[0] += 1
+            t[1] += record['duration']
+            f = self._out()
+            f.write(line)
+            f.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None and self.filePid == os.getpid():
+                self.file.close()
+            self.file = None
+
+    def summary(self,attack=None):
+        ''' Returns a table of the time spent per span name, for one attack or all '''
+        totals = {}
+        with self.lock:
+            for key,names in self.totals.items():
+                if attack is not None and key != attack:
+                    continue
+                for name,(count,seconds) in names.items():
+                    t = totals.setdefault(name,[0,0.0])
+                    t[0] += count
+                    t[1] += seconds
+        lines = [f"{'phase':<20} {'count':>6} {'seconds':>9} {'mean ms':>9}"]
+        for name,(count,seconds) in sorted(totals.items(),key=lambda x: -x[1][1]):
+            lines.append(f"{name:<20} {count:>6} {seconds:>9.3f} {1000*seconds/count:>9.2f}")
+        return '\n'.join(lines)
+
+class attackTracer:
+    def __init__(self,tracer,attack):
+        self.tracer = tracer
+        self.attack = attack
+        self.enabled = tracer.enabled
+
+    def span(self,name,**attrs):
+        if not self.enabled:
+            return _nullSpanInstance
+        return span(self.tracer,name,self.attack,attrs)
+
+    def summary(self):
+        return self.tracer.summary(self.attack)
+
+_tracer = None
+
+def getTracer():
+    ''' Returns the process-wide tracer, configured from ATTACK_TRACE. A relative
+        path is taken from the current directory.
+    '''
+    global _tracer
+    path = os.environ.get('ATTACK_TRACE')
+    path = os.path.abspath(path) if path else None
+    if _tracer is None or _tracer.path != path:
+        if _tracer is not None:
+            _tracer.close()
+        _tracer = tracer(path)
+    return _tracer
+
+def enableTracing(path):
+    os.environ['ATTACK_TRACE'] = os.path.abspath(path)
+    return getTracer()
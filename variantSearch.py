@@ -0,0 +1,276 @@
+import re
+import json
+import math
+import argparse
+import itertools
+import statistics
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import attacks
+import dbCache
+from anonClient import anonClient
+
+''' Automated search over variants of an attack. A variant template is an ordinary
+    attack spec whose strings may contain {name} placeholders, plus the ranges of
+    values each name takes, for instance:
+
+        {'template': {'attackType': 'simpleDifference',
+                      'describe': 'Lone value difference',
+                      'conditionsSql': "select count(*) from tab where t1='y' or i1={val}",
+                      'changes': [{'change':'append', 'table':'tab',
+                                   'spec': {'t1':['unique'],'i1':['unique']}}],
+                      'attack1': "select count(distinct aid1) from tab where {col}='y' or i1 = -i1-",
+                      'attack2': "select count(distinct aid1) from tab where {col}='y'",
+                      'difference': 1},
+         'ranges': {'col': ['t1','t2'], 'val': [100,200]}}
+
+    Every combination is built and checked on the raw data, which costs no
+    anonymized queries. The variants that pass are scored by how likely they are
+    to succeed against the anonymizer and how many anonymized queries they need,
+    and the most promising are run as real attacks, best value per query first,
+    until the query budget is spent.
+'''
+
+defaultNoiseSd = 1.0        # assumed noise sd per query condition, where the spec gives no noiseSd
+defaultMinSuccess = 0.9     # variants less likely than this to succeed are not promoted
+defaultMaxQueries = 1000    # anonymized queries the promoted variants may use in total
+
+_placeholder = re.compile(r'\{(\w+)\}')
+_normal = statistics.NormalDist()
+
+def _fill(value,params):
+    ''' Replaces the {name} placeholders in every string of value. A string that is
+        nothing but a placeholder takes the parameter value itself, so that numbers
+        and lists can vary too.
+    '''
+    if isinstance(value,str):
+        m = _placeholder.fullmatch(value)
+        if m and m.group(1) in params:
+            return params[m.group(1)]
+        return _placeholder.sub(lambda m: str(params.get(m.group(1),m.group(0))),value)
+    if isinstance(value,list):
+        return [_fill(v,params) for v in value]
+    if isinstance(value,dict):
+        return {k:_fill(v,params) for k,v in value.items()}
+    return value
+
+def enumerateVariants(template,ranges):
+    ''' Returns (params,attack) for every combination of the values in ranges.
+        Combinations that produce the same attack are only returned once.
+    '''
+    names = sorted(ranges)
+    variants = []
+    seen = set()
+    for values in itertools.product(*[ranges[name] for name in names]):
+        params = dict(zip(names,values))
+        attack = _fill(template,params)
+        key = json.dumps(attack,sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        attack['describe'] = f"{template['describe']} {params}"
+        variants.append((params,attack))
+    return variants
+
+def _numConditions(sql):
+    ''' The number of conditions in the WHERE clause of sql, at least one '''
+    parts = re.split(r'\bwhere\b',sql,maxsplit=1,flags=re.IGNORECASE)
+    if len(parts) < 2:
+        return 1
+    ops = re.findall(r"<>|<=|>=|=|<|>|\bin\b|\blike\b|\bbetween\b",parts[1],flags=re.IGNORECASE)
+    return max(1,len(ops))
+
+def _answerSd(ra,sql,noiseSd):
+    # The anonymizer adds a noise layer per condition, so more conditions mean more noise
+    return noiseSd * math.sqrt(_numConditions(ra._doSqlReplace(sql)))
+
+def _roundsRight(sd):
+    ''' Probability that noise of this sd stays within half a user '''
+    return 2 * _normal.cdf(0.5 / sd) - 1
+
+def _scoreDifference(ra,noiseSd):
+    sd = math.hypot(_answerSd(ra,ra.attack['attack1'],noiseSd),
+                    _answerSd(ra,ra.attack['attack2'],noiseSd))
+    return _roundsRight(sd),2
+
+def _scoreFirstDerivitiveDifference(ra,noiseSd):
+    sd = math.hypot(_answerSd(ra,ra.attack['attack1'],noiseSd),
+                    _answerSd(ra,ra.attack['attack2'],noiseSd))
+    numBuckets = len(ra._queryRaw(ra._doSqlReplace(ra.attack['attack2'])))
+    # The victim's bucket differs by one user and has to beat every other bucket
+    beatOne = _normal.cdf(1 / (sd * math.sqrt(2)))
+    return beatOne ** max(0,numBuckets - 1),2
+
+def _scoreAveraging(ra,noiseSd):
+    repeats = ra.attack['repeats']
+    if 'adaptive' in ra.attack:
+        repeats = ra.attack['adaptive'].get('maxQueries',attacks.defaultNumSamples)
+    sd = _answerSd(ra,ra.attack['attack'],noiseSd)
+    return _roundsRight(sd / math.sqrt(repeats)),repeats
+
+def _scoreSplitAveraging(ra,noiseSd):
+    numVals = len(ra.attack['attackVals'])
+    sd = math.hypot(_answerSd(ra,ra.attack['attackTemplate1'],noiseSd),
+                    _answerSd(ra,ra.attack['attackTemplate2'],noiseSd))
+    return _roundsRight(sd / math.sqrt(numVals)),2 * numVals
+
+scoreMap = {
+    'simpleDifference': _scoreDifference,
+    'simpleFirstDerivitiveDifference': _scoreFirstDerivitiveDifference,
+    'simpleAveraging': _scoreAveraging,
+    'splitAveraging': _scoreSplitAveraging,
+}
+
+def _checkOne(index,params,attack,noiseSd):
+    ''' Builds one variant without uploading it, checks it on the raw data and
+        scores it. Returns the outcome as a candidate dict.
+    '''
+    candidate = {'index':index,
+                 'params':params,
+                 'attack':attack,
+                 'passed':False,
+                 'error':None,
+                 }
+    try:
+        ra = attacks.runAttack(attack,upload=False)
+        ra.runCheck()
+        pSuccess,queries = scoreMap[attack['attackType']](ra,attack.get('noiseSd',noiseSd))
+        candidate.update({'passed':True,
+                          'pSuccess':pSuccess,
+                          'queries':queries,
+                          'valuePerQuery':pSuccess / queries,
+                          })
+        ra.close()
+    except attacks.attackFailed as e:
+        candidate['error'] = str(e)
+    except Exception:
+        candidate['error'] = traceback.format_exc()
+    return candidate
+
+def _checkGroup(group,noiseSd):
+    return [_checkOne(index,params,attack,noiseSd) for index,params,attack in group]
+
+def checkVariants(variants,noiseSd=defaultNoiseSd,numWorkers=attacks.defaultNumWorkers):
+    ''' Checks and scores all variants over a pool of worker processes. Variants
+        that share their base tables are checked by the same worker, as in
+        attacks.runSuite(). Returns one candidate dict per variant, in order.
+    '''
+    groups = {}
+    for index,(params,attack) in enumerate(variants):
+        key = dbCache.baseHash(attack,attack.get('seed',dbCache.defaultSeed))
+        groups.setdefault(key,[]).append((index,params,attack))
+    numWorkers = max(1,min(numWorkers,len(groups)))
+    with ProcessPoolExecutor(max_workers=numWorkers,initializer=attacks._initWorker) as pool:
+        futures = [pool.submit(_checkGroup,group,noiseSd) for group in groups.values()]
+        candidates = [c for future in futures for c in future.result()]
+    return sorted(candidates,key=lambda c: c['index'])
+
+def _promoteAll(ranked,maxQueries,queryUrl,fileUrl):
+    client = anonClient(queryUrl)
+    spent = 0
+    for candidate in ranked:
+        if spent + candidate['queries'] > maxQueries:
+            # A cheaper candidate further down may still fit
+            continue
+        candidate['promoted'] = True
+        sent = client.answered
+        try:
+            ra = attacks.runAttack(candidate['attack'],queryUrl=queryUrl,fileUrl=fileUrl,
+                                   client=client)
+            ra.runAttack()
+            candidate['outcome'] = ra.outcome
+            candidate['succeeded'] = bool(ra.outcome and ra.outcome['correct'])
+        except attacks.attackFailed as e:
+            candidate['error'] = str(e)
+        except Exception:
+            candidate['error'] = traceback.format_exc()
+        # Answers from the query cache cost nothing, so count what was really sent
+        candidate['anonQueries'] = client.answered - sent
+        spent += candidate['anonQueries']
+    client.close()
+    return ranked
+
+def promote(candidates,maxQueries=defaultMaxQueries,minSuccess=defaultMinSuccess,
+            queryUrl='https://db-proto.probsteide.com/api',
+            fileUrl='https://db-proto.probsteide.com/api/upload-db'):
+    ''' Runs the checked candidates that are likely enough to succeed against the
+        anonymizer, best value per query first, within a budget of maxQueries
+        anonymized queries. Updates the candidates in place and returns them.
+    '''
+    for candidate in candidates:
+        candidate['promoted'] = False
+        candidate['succeeded'] = False
+    ranked = [c for c in candidates if c['passed'] and c['pSuccess'] >= minSuccess]
+    ranked.sort(key=lambda c: c['valuePerQuery'],reverse=True)
+    if len(ranked) == 0:
+        return candidates
+    # Promoted attacks run in a worker, for the same private working directory
+    with ProcessPoolExecutor(max_workers=1,initializer=attacks._initWorker) as pool:
+        ranked = pool.submit(_promoteAll,ranked,maxQueries,queryUrl,fileUrl).result()
+    byIndex = {c['index']:c for c in ranked}
+    for i,candidate in enumerate(candidates):
+        candidates[i] = byIndex.get(candidate['index'],candidate)
+    return candidates
+
+def searchVariants(template,ranges,checkOnly=False,noiseSd=defaultNoiseSd,
+                   maxQueries=defaultMaxQueries,minSuccess=defaultMinSuccess,
+                   numWorkers=attacks.defaultNumWorkers,
+                   queryUrl='https://db-proto.probsteide.com/api',
+                   fileUrl='https://db-proto.probsteide.com/api/upload-db'):
+    ''' Enumerates, checks and (unless checkOnly) promotes the variants of template.
+        Returns one candidate dict per variant.
+    '''
+    if template['attackType'] not in scoreMap:
+        raise ValueError(f"variant search does not support {template['attackType']} attacks")
+    variants = enumerateVariants(template,ranges)
+    print(f"checking {len(variants)} variants")
+    candidates = checkVariants(variants,noiseSd=noiseSd,numWorkers=numWorkers)
+    if not checkOnly:
+        candidates = promote(candidates,maxQueries=maxQueries,minSuccess=minSuccess,
+                             queryUrl=queryUrl,fileUrl=fileUrl)
+    return candidates
+
+def report(candidates):
+    ''' Prints the candidates, most valuable first '''
+    def order(c):
+        return (c['passed'],c.get('valuePerQuery',0))
+    print(f"{'params':<40} {'check':>6} {'pSucc':>6} {'cost':>5} {'anon':>6}")
+    for c in sorted(candidates,key=order,reverse=True):
+        params = json.dumps(c['params'],sort_keys=True)
+        if not c['passed']:
+            print(f"{params:<40} {'fail':>6}")
+            continue
+        if not c.get('promoted'):
+            anon = '-'
+        elif c.get('succeeded'):
+            anon = 'ok'
+        else:
+            anon = 'FAILED'
+        print(f"{params:<40} {'ok':>6} {c['pSuccess']:>6.3f} {c['queries']:>5} {anon:>6}")
+    numPassed = len([c for c in candidates if c['passed']])
+    numSucceeded = len([c for c in candidates if c.get('succeeded')])
+    print(f"{len(candidates)} variants, {numPassed} passed the check, {numSucceeded} succeeded")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search over variants of an attack')
+    parser.add_argument('spec',help="json file with a 'template' attack and the 'ranges' of its placeholders")
+    parser.add_argument('--checkOnly',action='store_true',help='only check the variants on the raw data')
+    parser.add_argument('--noiseSd',type=float,default=defaultNoiseSd)
+    parser.add_argument('--maxQueries',type=int,default=defaultMaxQueries,help='anonymized query budget')
+    parser.add_argument('--minSuccess',type=float,default=defaultMinSuccess,
+                        help='lowest estimated success probability that is promoted')
+    parser.add_argument('--workers',type=int,default=attacks.defaultNumWorkers)
+    parser.add_argument('--queryUrl',default='https://db-proto.probsteide.com/api')
+    parser.add_argument('--fileUrl',default='https://db-proto.probsteide.com/api/upload-db')
+    parser.add_argument('--out',default=None,help='file to write the candidates to as json')
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+    candidates = searchVariants(spec['template'],spec['ranges'],checkOnly=args.checkOnly,
+                                noiseSd=args.noiseSd,maxQueries=args.maxQueries,
+                                minSuccess=args.minSuccess,numWorkers=args.workers,
+                                queryUrl=args.queryUrl,fileUrl=args.fileUrl)
+    report(candidates)
+    if args.out is not None:
+        with open(args.out,'w') as f:
+            json.dump(candidates,f,indent=2,default=str)